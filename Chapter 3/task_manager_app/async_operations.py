@@ -0,0 +1,88 @@
+"""Async counterpart of operations.py for the async route handlers.
+
+Once the store is loaded, reads are plain in-memory lookups and are done
+directly on the event loop through the functions in operations.py.
+Anything that can touch the disk (the first load, catching up with another
+worker's writes, writes and their fsync, shutdown) is sent to a small
+dedicated executor, so the event loop never blocks on I/O and reads only
+wait for a thread when another worker changed the data."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+import operations
+from change_feed import ChangeEvent
+from models import Task, TaskWithId, PatchTask, BulkResult
+from store import TaskStore
+
+STORAGE_IO_WORKERS = 4
+# How often a waiting change-feed reader checks for writes by other workers
+STALE_CHECK_INTERVAL = 0.25
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=STORAGE_IO_WORKERS, thread_name_prefix='task-storage')
+    return _executor
+
+
+async def run_io(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(func, *args))
+
+
+async def load_tasks() -> TaskStore:
+    if operations.needs_load() or operations.task_store.is_stale():
+        await run_io(operations.load_tasks)
+    return operations.task_store
+
+
+async def wait_for_changes(since: int, timeout: float) -> Optional[list[ChangeEvent]]:
+    '''Changes after since, waiting up to timeout seconds for the first one.
+
+    This worker's own writes wake the wait at once; writes by other workers
+    are noticed by checking the shared commit counter every
+    STALE_CHECK_INTERVAL seconds.'''
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        store = await load_tasks()
+        remaining = deadline - loop.time()
+        changes = await store.feed.wait(since, max(0.0, min(remaining, STALE_CHECK_INTERVAL)))
+        if changes != [] or remaining <= STALE_CHECK_INTERVAL:
+            return changes
+
+
+async def close_tasks() -> None:
+    global _executor
+    await run_io(operations.close_tasks)
+    executor, _executor = _executor, None
+    executor.shutdown(wait=True)
+
+
+async def create_task(task: Task) -> TaskWithId:
+    await load_tasks()
+    return await run_io(operations.create_task, task)
+
+
+async def update_task(task_id: int, updated_task) -> Optional[TaskWithId]:
+    await load_tasks()
+    return await run_io(operations.update_task, task_id, updated_task)
+
+
+async def patch_task(task_id: int, patch: PatchTask) -> Optional[TaskWithId]:
+    await load_tasks()
+    return await run_io(operations.patch_task, task_id, patch)
+
+
+async def delete_task(task_id: int) -> bool:
+    await load_tasks()
+    return await run_io(operations.delete_task, task_id)
+
+
+async def apply_bulk(bulk_operations: list) -> list[BulkResult]:
+    await load_tasks()
+    return await run_io(operations.apply_bulk, bulk_operations)
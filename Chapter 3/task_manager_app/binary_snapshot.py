@@ -0,0 +1,351 @@
+"""Columnar binary copy of the CSV snapshot, for fast startup.
+
+Compaction writes it next to tasks.csv (as tasks.csv.bin). A worker that
+finds one matching the current CSV maps it into memory instead of parsing
+CSV, and uses it in place: the ids are one packed array, each text column
+is an array of byte offsets into one UTF-8 blob, and the search, title and
+field indexes the store would otherwise build task by task at startup are
+stored ready to use, as sorted keys with a packed array of sorted ids per
+key. The file is mapped read-only, so the page cache holds one copy of it
+however many workers map it.
+
+Layout, all little-endian, every section starting on an 8-byte boundary:
+    header   magic, format version, flags, row count, column count,
+             inode / size / mtime_ns of the CSV it was written with
+    columns  id: int64 * count
+             per text column, then the task versions: int64 byte offset *
+             (count + 1), blob
+    indexes  (with INDEXED set) per posting map in POSTINGS: int64 key
+             count, the keys as a text column, int64 posting offset *
+             (keys + 1), int64 ids; the ids whose text has no trigram as
+             int64 count and ids; the casefolded titles in sorted order as
+             a text column, and their int64 ids
+    trailer  CRC-32 of everything before it
+
+Values come back as parsing the CSV would give them, except that an empty
+field of a nullable column comes back as None. A file whose CRC does not
+match, or that was written for another version of the CSV, is ignored and
+the CSV is parsed as before."""
+
+import bisect
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import accumulate, chain
+from typing import Collection, Iterable, Iterator, NamedTuple, Optional, Sequence
+from search_index import build_postings
+
+MAGIC = b'TSNP'
+FORMAT_VERSION = 3
+HEADER = struct.Struct('<4sHHIHQQQ')
+COUNT = struct.Struct('<Q')
+TRAILER = struct.Struct('<I')
+# Flag: the file carries the indexes, not just the columns
+INDEXED = 1
+# Text column after the CSV ones: storage.committed() of the data in which
+# each task last changed, empty if the writer did not know it
+VERSION_COLUMN = 'version'
+# Posting maps in the order they are stored
+POSTINGS = ('words', 'grams', 'status', 'priority')
+ALIGNMENT = 8
+
+
+class TaskText(NamedTuple):
+    id: int
+    title: str
+    description: Optional[str]
+
+
+def csv_stamp(path: str) -> tuple[int, int, int]:
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _pack_array(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class _Writer:
+    '''Sections written straight to the file, checksummed on the way'''
+
+    def __init__(self, file):
+        self.file = file
+        self.size = 0
+        self.crc = 0
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+
+    def align(self) -> None:
+        self.write(bytes(-self.size % ALIGNMENT))
+
+    def int64s(self, values: Iterable[int]) -> None:
+        self.write(_pack_array(array('q', values)))
+
+    def texts(self, values: Sequence[str]) -> None:
+        encoded = [value.encode() for value in values]
+        self.int64s(accumulate(map(len, encoded), initial=0))
+        self.write(b''.join(encoded))
+        self.align()
+
+    def postings(self, postings: dict[str, list[int]]) -> None:
+        keys = sorted(postings)  # code point order, which is UTF-8 byte order
+        self.write(COUNT.pack(len(keys)))
+        self.texts(keys)
+        self.int64s(accumulate((len(postings[key]) for key in keys), initial=0))
+        self.int64s(chain.from_iterable(postings[key] for key in keys))
+
+
+def _field_postings(ids: list[int], values: list[Optional[str]]) -> dict[str, list[int]]:
+    postings: dict[str, list[int]] = {}
+    for task_id, value in zip(ids, values):
+        postings.setdefault(value or '', []).append(task_id)
+    return postings
+
+
+def write_snapshot(path: str, columns: list[str], rows: list[dict], stamp: tuple[int, int, int],
+                   indexes: bool = True) -> None:
+    '''Write rows (dicts with an int id, in id order) to path, tagged with
+    the CSV stamp, and with indexes, what the store indexes them by'''
+    ids = [row['id'] for row in rows]
+    values = {column: [row.get(column) or '' for row in rows] for column in columns[1:] + [VERSION_COLUMN]}
+    with open(path, 'wb') as file:
+        writer = _Writer(file)
+        writer.write(HEADER.pack(MAGIC, FORMAT_VERSION, INDEXED if indexes else 0, len(rows), len(columns), *stamp))
+        writer.align()
+        writer.int64s(ids)
+        for column_values in values.values():
+            writer.texts(column_values)
+        if indexes:
+            words, grams, short = build_postings(map(TaskText, ids, values['title'], values['description']))
+            for postings in (words, grams, _field_postings(ids, values['status']),
+                             _field_postings(ids, values['priority'])):
+                writer.postings(postings)
+            writer.write(COUNT.pack(len(short)))
+            writer.int64s(short)
+            titles = sorted(zip((title.casefold() for title in values['title']), ids))
+            writer.texts([title for title, _ in titles])
+            writer.int64s(task_id for _, task_id in titles)
+        file.write(TRAILER.pack(writer.crc))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class Texts:
+    '''Strings stored as byte offsets into one UTF-8 blob. Items are the
+    encoded bytes, which sort like the strings, so the sequence can be
+    bisected with encoded keys.'''
+
+    def __init__(self, offsets: Sequence[int], blob: memoryview):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position: int) -> bytes:
+        return self.blob[self.offsets[position]:self.offsets[position + 1]].tobytes()
+
+    def text(self, position: int) -> str:
+        return str(self.blob[self.offsets[position]:self.offsets[position + 1]], 'utf-8')
+
+    def decode(self) -> list[str]:
+        '''Every string, decoding the blob in one call when it is ASCII'''
+        text = str(self.blob, 'utf-8')
+        offsets = self.offsets
+        if len(text) != len(self.blob):
+            return [self.text(position) for position in range(len(self))]
+        return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def containing(self, fragment: str) -> Iterator[int]:
+        '''Positions of the strings containing fragment, found with a scan of
+        the blob rather than a decode of every string'''
+        if not fragment:
+            yield from range(len(self))
+            return
+        blob, needle, offsets = self.blob.tobytes(), fragment.encode(), self.offsets
+        start = 0
+        while (found := blob.find(needle, start)) >= 0:
+            position = bisect.bisect_right(offsets, found) - 1
+            end = offsets[position + 1]
+            if found + len(needle) <= end:
+                yield position
+                start = end
+            else:
+                start = found + 1  # ran into the next string
+
+
+class Postings:
+    '''A posting map of a snapshot: key -> sorted ids, read in place. In a
+    nullable field the empty key holds the tasks without a value.'''
+
+    def __init__(self, keys: Texts, offsets: Sequence[int], ids: Sequence[int], nullable: bool = False):
+        self.keys = keys
+        self.offsets = offsets
+        self.ids = ids
+        self.nullable = nullable
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _posting(self, position: int) -> Sequence[int]:
+        return self.ids[self.offsets[position]:self.offsets[position + 1]]
+
+    def get(self, key: Optional[str], default=()):
+        encoded = (key or '').encode() if self.nullable else key.encode()
+        position = bisect.bisect_left(self.keys, encoded)
+        if position < len(self.keys) and self.keys[position] == encoded:
+            return self._posting(position)
+        return default
+
+    def items(self) -> Iterator[tuple[Optional[str], Sequence[int]]]:
+        for position in range(len(self.keys)):
+            key = self.keys.text(position)
+            yield (key or None) if self.nullable else key, self._posting(position)
+
+    def containing(self, fragment: str) -> Iterator[tuple[str, Sequence[int]]]:
+        '''The keys containing fragment, with their postings'''
+        for position in self.keys.containing(fragment):
+            yield self.keys.text(position), self._posting(position)
+
+
+class Titles:
+    '''(casefolded title, id) entries in sorted order, read in place'''
+
+    def __init__(self, keys: Texts, ids: Sequence[int]):
+        self.keys = keys
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class _Reader:
+    def __init__(self, data: memoryview):
+        self.data = data
+        self.offset = 0
+
+    def align(self) -> None:
+        self.offset += -self.offset % ALIGNMENT
+
+    def count(self) -> int:
+        (value,) = COUNT.unpack_from(self.data, self.offset)
+        self.offset += COUNT.size
+        return value
+
+    def int64s(self, count: int) -> Sequence[int]:
+        data = self.data[self.offset:self.offset + 8 * count]
+        self.offset += 8 * count
+        if sys.byteorder == 'little':
+            return data.cast('q')
+        values = array('q')
+        values.frombytes(data)
+        values.byteswap()
+        return values
+
+    def texts(self, count: int) -> Texts:
+        offsets = self.int64s(count + 1)
+        blob = self.data[self.offset:self.offset + offsets[-1]]
+        self.offset += offsets[-1]
+        self.align()
+        return Texts(offsets, blob)
+
+    def postings(self, nullable: bool) -> Postings:
+        count = self.count()
+        keys = self.texts(count)
+        offsets = self.int64s(count + 1)
+        return Postings(keys, offsets, self.int64s(offsets[-1]), nullable)
+
+
+class Snapshot:
+    '''A binary snapshot mapped into memory. Nothing is copied out of the
+    mapping until asked for; ids and postings are int64 sequences over it
+    that bisect works on.'''
+
+    def __init__(self, data: memoryview, columns: list[str], count: int, flags: int,
+                 nullable: Collection[str] = ()):
+        reader = _Reader(data)
+        reader.offset = HEADER.size
+        reader.align()
+        self.count = count
+        self.nullable = frozenset(nullable)
+        self.ids = reader.int64s(count)
+        self._texts = {column: reader.texts(count) for column in columns[1:] + [VERSION_COLUMN]}
+        self.postings: dict[str, Postings] = {}
+        self.short: Sequence[int] = ()
+        self.titles: Optional[Titles] = None
+        if flags & INDEXED:
+            self.postings = {name: reader.postings(name in self.nullable) for name in POSTINGS}
+            self.short = reader.int64s(reader.count())
+            keys = reader.texts(count)
+            self.titles = Titles(keys, reader.int64s(count))
+
+    @property
+    def indexed(self) -> bool:
+        return self.titles is not None
+
+    def row_of(self, task_id: int) -> Optional[int]:
+        ids, count = self.ids, self.count
+        if not count or not ids[0] <= task_id <= ids[-1]:
+            return None
+        # Ids are distinct integers, so each gap before or after task_id
+        # bounds its row; with few deletions that leaves a step or two
+        low = max(0, count - 1 - (ids[-1] - task_id))
+        position = bisect.bisect_left(ids, task_id, low, min(count, task_id - ids[0] + 1))
+        if position < count and ids[position] == task_id:
+            return position
+        return None
+
+    def texts(self, column: str) -> Texts:
+        '''The values of a text column, read in place'''
+        return self._texts[column]
+
+    def column(self, column: str) -> list:
+        '''Every value of column; a list of ints for the ids'''
+        if column not in self._texts:
+            return list(self.ids)
+        values = self._texts[column].decode()
+        if column in self.nullable:
+            return [value or None for value in values]
+        return values
+
+    def max_id(self) -> int:
+        return self.ids[-1] if self.count else 0
+
+
+def open_snapshot(path: str, columns: list[str], stamp: tuple[int, int, int],
+                  nullable: Collection[str] = ()) -> Optional[Snapshot]:
+    '''Map path, or return None if it is missing, corrupt or not for this CSV.
+    The checksum is verified over the whole file, which reads it once.'''
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < HEADER.size + TRAILER.size:
+                return None
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    data = memoryview(mapping)
+    payload = data[:-TRAILER.size]
+    (checksum,) = TRAILER.unpack_from(data, len(payload))
+    magic, version, flags, count, column_count, *written_for = HEADER.unpack_from(payload)
+    if (magic != MAGIC or version != FORMAT_VERSION or column_count != len(columns)
+            or tuple(written_for) != tuple(stamp) or zlib.crc32(payload) != checksum):
+        return None
+    return Snapshot(payload, columns, count, flags, nullable)
+
+
+def read_snapshot(path: str, columns: list[str], stamp: tuple[int, int, int]) -> Optional[dict[str, list]]:
+    '''Values from path, one list per column, or None if it is missing,
+    corrupt or not for this CSV'''
+    snapshot = open_snapshot(path, columns, stamp)
+    if snapshot is None:
+        return None
+    return {column: snapshot.column(column) for column in columns}
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from collections import deque
+from typing import NamedTuple, Optional
+
+# Change events kept for clients that fall behind; older ones must resync
+CHANGE_FEED_SIZE = 1024
+
+
+class ChangeEvent(NamedTuple):
+    seq: int
+    op: str  # "create", "update" or "delete"
+    id: int
+    # The task after the change, None for a delete; whatever the store keeps
+    task: object
+
+
+class ChangeFeed:
+    '''Bounded ring buffer of task changes with increasing sequence numbers.
+
+    The store publishes every change it applies, its own writes and those
+    it replays from other workers, so a client that remembers the last
+    sequence number it saw can ask for just what changed since. When the
+    buffer has moved past that number, or the store reloaded everything
+    and cannot describe the difference, since() says so and the client has
+    to fetch the full listing again.
+
+    Writers publish from storage threads; waiters may be coroutines on an
+    event loop, which are woken through call_soon_threadsafe.'''
+
+    def __init__(self, size: int = CHANGE_FEED_SIZE):
+        self._events: deque[ChangeEvent] = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.seq = 0
+        # Highest sequence number no longer in the buffer
+        self._floor = 0
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = []
+
+    def publish(self, changes: list[tuple[str, int, object]]) -> None:
+        '''Append (op, id, task) changes and wake everyone waiting'''
+        if not changes:
+            return
+        with self._lock:
+            for op, task_id, task in changes:
+                if len(self._events) == self._events.maxlen:
+                    self._floor = self._events[0].seq
+                self.seq += 1
+                self._events.append(ChangeEvent(self.seq, op, task_id, task))
+            self._wake()
+
+    def reset(self) -> None:
+        '''Forget the buffered events, e.g. after a full reload; clients
+        behind the current sequence number must resync'''
+        with self._lock:
+            self._events.clear()
+            self._floor = self.seq
+            self._wake()
+
+    def since(self, seq: int) -> Optional[list[ChangeEvent]]:
+        '''Events after seq, or None if they are no longer all buffered.
+        A seq ahead of the feed comes from another process or an earlier
+        run of this one and cannot be continued either.'''
+        with self._lock:
+            if seq < self._floor or seq > self.seq:
+                return None
+            skip = len(self._events) - (self.seq - seq)
+            return [self._events[i] for i in range(skip, len(self._events))]
+
+    async def wait(self, seq: int, timeout: float) -> Optional[list[ChangeEvent]]:
+        '''Like since(), but wait up to timeout seconds for something newer than seq'''
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            self._waiters.append(waiter)
+        try:
+            changes = self.since(seq)
+            if changes == []:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                changes = self.since(seq)
+            return changes
+        finally:
+            with self._lock:
+                self._waiters.remove(waiter)
+
+    def _wake(self) -> None:
+        for loop, event in self._waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # that loop has closed
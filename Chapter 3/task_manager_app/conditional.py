@@ -0,0 +1,55 @@
+"""Conditional GETs for the task read endpoints.
+
+The store bumps a dataset version on every change and stamps each task
+with the version that last touched it. Versions come from the storage's
+shared commit count, so every worker issues the same ETag for the same
+data. Those make strong ETags, so a poll carrying If-None-Match (or
+If-Modified-Since) for unchanged data is answered with 304 before the body
+is ever built, whichever worker it reaches."""
+
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(","))
+
+
+def modified_since(if_modified_since: str, last_modified: float) -> bool:
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return True  # an unparseable date is ignored
+    return int(last_modified) > since
+
+
+def validated_second(last_modified: float) -> int:
+    '''Whole second to send as Last-Modified. HTTP dates have no fractions, so
+    another change in the second that is still running could not be told
+    apart from this one; until that second is over the one before it is
+    sent, and If-Modified-Since with it always finds the data modified.'''
+    return min(int(last_modified), int(time.time()) - 1)
+
+
+def not_modified(request: Request, response: Response, etag: str, last_modified: float) -> Optional[Response]:
+    '''Set the validators on response and return a 304 if the client's copy is current'''
+    response.headers["ETag"] = etag
+    response.headers["Last-Modified"] = formatdate(validated_second(last_modified), usegmt=True)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        fresh = etag_matches(if_none_match, etag)
+    else:
+        if_modified_since = request.headers.get("if-modified-since")
+        fresh = if_modified_since is not None and not modified_since(if_modified_since, last_modified)
+    if not fresh:
+        return None
+    return Response(status_code=304, headers=response.headers)
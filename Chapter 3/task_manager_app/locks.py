@@ -0,0 +1,111 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; fall back to in-process locking only
+    fcntl = None
+
+
+class ReadWriteLock:
+    '''Many concurrent readers or a single writer.
+
+    The writer may re-enter its own lock or take the read side, and
+    waiting writers hold off new readers so a steady stream of reads cannot
+    starve writes. In turn, the readers waiting when a writer lets go get
+    in before the next writer, so a writer taking the lock again and again
+    cannot starve reads either. Readers must not re-enter.'''
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._waiting_readers = 0
+        # Readers let in ahead of waiting writers when the last writer let go
+        self._admitted = 0
+
+    def acquire_read(self) -> None:
+        with self._cond:
+            if self._writer == threading.get_ident():
+                self._writer_depth += 1  # the writer already excludes everyone else
+                return
+            if self._writer is not None or self._waiting_writers:
+                self._waiting_readers += 1
+                while self._writer is not None or (self._waiting_writers and not self._admitted):
+                    self._cond.wait()
+                self._waiting_readers -= 1
+                if self._admitted:
+                    self._admitted -= 1
+            self._readers += 1
+
+    def release_read(self) -> None:
+        with self._cond:
+            if self._writer == threading.get_ident():
+                self._writer_depth -= 1
+                return
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self) -> bool:
+        '''Take the write lock; return True for the outermost acquisition'''
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writer_depth += 1
+                return False
+            self._waiting_writers += 1
+            while self._writer is not None or self._readers or self._admitted:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = me
+            self._writer_depth = 1
+            return True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer_depth -= 1
+            if not self._writer_depth:
+                self._writer = None
+                self._admitted = self._waiting_readers
+                self._cond.notify_all()
+
+    @contextmanager
+    def read_locked(self) -> Iterator[None]:
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+
+class FileLock:
+    '''Advisory fcntl lock on a sidecar file, shared between processes.
+
+    Every process (e.g. each uvicorn worker) opens its own descriptor, so
+    flock() excludes the other workers; threads within a process must be
+    serialised separately, which the ReadWriteLock does.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    def acquire(self, shared: bool = False) -> None:
+        if fcntl is None:
+            return
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+    def release(self) -> None:
+        if fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
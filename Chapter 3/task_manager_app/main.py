@@ -1,89 +1,284 @@
-from fastapi import FastAPI, HTTPException, Request, Header, Depends
-from typing import Optional
-from models import Task, TaskWithId, UpdateTask, TaskV2WithId
-from operations import read_all_tasks, read_task_by_id, create_task, update_task, read_all_tasks_v2
-import csv
-
-def enforce_version(x_api_version: str = Header(...)):
-    if x_api_version != "1":
-        raise HTTPException(status_code=426, detail="Please upgrade your client to use a supported API version.")
-
-def app_lifespan(app):
-    # Startup logic
+from fastapi import FastAPI, HTTPException, Request, Response, Header, Query
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+import gc
+from typing import AsyncIterator, Literal, Optional
+from models import Task, TaskWithId, UpdateTask, PatchTask, TaskV2WithId, BulkOperation, BulkResult, ChangeBatch, TaskStats
+from operations import read_all_tasks, read_task_by_id, read_all_tasks_v2
+from operations import search_tasks_by_keyword, suggest_tasks, read_tasks_page, read_tasks_page_v2, iter_tasks
+from operations import read_dataset_version, read_task_version, change_batch, to_change, read_task_stats
+from operations import change_cursor, parse_change_cursor
+from conditional import make_etag, not_modified
+from pagination import NEXT_CURSOR_HEADER, decode_cursor, set_next_cursor, set_next_page
+from response_cache import ResponseCache
+from serialization import json_response, task_list, task_v2_list
+import async_operations
+from versioning import ApiVersionMiddleware
+
+# Longest a GET /tasks/changes request is held open, and the SSE keep-alive period
+CHANGES_MAX_WAIT = 60.0
+SSE_KEEPALIVE = 15.0
+SUGGEST_MAX_LIMIT = 100
+
+@asynccontextmanager
+async def app_lifespan(app):
+    # Startup logic: parse the CSV and replay the mutation log into the in-memory task store
     try:
-        read_all_tasks()
+        await async_operations.load_tasks()
     except Exception as e:
         print(f"Error loading CSV file on startup: {e}")
+    # Move the startup load to the permanent generation once, so full
+    # collections while serving don't walk every loaded task
+    gc.freeze()
     yield
-    # Shutdown logic (if needed)
+    # Shutdown logic: let a running log compaction finish, and hand what was
+    # frozen back to the collector so an app started again can free it
+    gc.unfreeze()
+    await async_operations.close_tasks()
 
 app = FastAPI(lifespan=app_lifespan)
 
+response_cache = ResponseCache()
+
+def dataset_not_modified(request: Request, response: Response) -> Optional[Response]:
+    '''304 for a listing whose client copy matches the current dataset version,
+    else the cached body for this route and query string, if there is one'''
+    version, last_modified = read_dataset_version()
+    cached = not_modified(request, response, make_etag(version), last_modified)
+    if cached is not None:
+        return cached
+    hit = response_cache.get(response.headers["ETag"], listing_key(request))
+    if hit is None:
+        return None
+    body, cursor = hit
+    if cursor is not None:
+        set_next_cursor(request, response, cursor)
+    return Response(body, media_type="application/json", headers=response.headers)
+
+def listing_key(request: Request) -> tuple:
+    return request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+def cached_listing(request: Request, response: Response, adapter, tasks: list) -> Response:
+    '''Encode a listing and keep the bytes for identical requests until the next write'''
+    encoded = json_response(adapter, tasks, response)
+    response_cache.put(response.headers["ETag"], listing_key(request),
+                       (encoded.body, response.headers.get(NEXT_CURSOR_HEADER)), len(encoded.body))
+    return encoded
+
 @app.get("/tasks", response_model=list[TaskWithId])
-def get_tasks(
+async def get_tasks(
     request: Request,
+    response: Response,
     status: Optional[str] = None,
     title: Optional[str] = None,
-    depends=Depends(enforce_version),
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[str] = None,
+    ):
+    await async_operations.load_tasks()
+    after_id = decode_cursor(after)
+    cached = dataset_not_modified(request, response)
+    if cached is not None:
+        return cached
+    if not (status or title or limit or after):
+        return cached_listing(request, response, task_list, read_all_tasks())
+    # filter by status and/or title through the store's indexes, one page at a time
+    tasks, has_more = read_tasks_page(
+        after=after_id, limit=limit, status=status or None, title=title or None,
+    )
+    set_next_page(request, response, tasks, has_more)
+    return cached_listing(request, response, task_list, tasks)
+
+
+async def ndjson_lines() -> AsyncIterator[bytes]:
+    for task in iter_tasks():
+        yield task.model_dump_json().encode() + b"\n"
+
+async def json_array_chunks() -> AsyncIterator[bytes]:
+    yield b"["
+    separator = b""
+    for task in iter_tasks():
+        yield separator + task.model_dump_json().encode()
+        separator = b","
+    yield b"]"
+
+'''Stream every task as NDJSON (one object per line) or as a chunked JSON array, so memory stays flat however many tasks there are'''
+@app.get("/tasks/export")
+async def export_tasks(
+    format: Literal["ndjson", "json"] = "ndjson",
+    ):
+    await async_operations.load_tasks()
+    if format == "json":
+        return StreamingResponse(json_array_chunks(), media_type="application/json")
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+'''Long-poll for changes after the cursor since: answers at once if there
+are any, else waits up to timeout seconds for the next write. Without since
+it returns the current cursor to start from. A cursor another worker handed
+out gets a reset, as its sequence numbers mean nothing here.'''
+@app.get("/tasks/changes", response_model=ChangeBatch)
+async def get_task_changes(
+    since: Optional[str] = Query(None),
+    timeout: float = Query(30.0, ge=0, le=CHANGES_MAX_WAIT),
     ):
-    tasks = read_all_tasks()
-    if status:
-        tasks = [task for task in tasks if task.status == status] # filter by status if provided
-    if title:
-        tasks = [task for task in tasks if task.title == title] # filter by title if provided
-    return tasks
+    store = await async_operations.load_tasks()
+    if since is None:
+        return change_batch(store.feed.seq, [])
+    seq = parse_change_cursor(since)
+    if seq is None:
+        return change_batch(None, None)
+    return change_batch(seq, await async_operations.wait_for_changes(seq, timeout))
 
+def sse_event(event: str, data: str, event_id: Optional[str] = None) -> bytes:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {data}"]
+    return ("\n".join(lines) + "\n\n").encode()
+
+async def change_events(since: Optional[str]) -> AsyncIterator[bytes]:
+    '''One SSE event per change, named after its op and carrying its cursor
+    as the event id; a reset event when changes were missed or the cursor
+    to resume from was handed out by another worker'''
+    store = await async_operations.load_tasks()
+    seq = store.feed.seq if since is None else parse_change_cursor(since)
+    while True:
+        changes = None if seq is None else await async_operations.wait_for_changes(seq, SSE_KEEPALIVE)
+        if changes is None:
+            batch = change_batch(seq, None)
+            seq = batch.seq
+            yield sse_event("reset", batch.model_dump_json(include={"epoch", "seq", "cursor"}), batch.cursor)
+        elif not changes:
+            yield b": keep-alive\n\n"
+        for change in changes or ():
+            yield sse_event(change.op, to_change(change).model_dump_json(), change_cursor(change.seq))
+            seq = change.seq
+
+'''Server-Sent Events stream of task changes; a reconnecting client resumes from its Last-Event-ID'''
+@app.get("/tasks/changes/stream")
+async def stream_task_changes(
+    since: Optional[str] = Query(None),
+    last_event_id: Optional[str] = Header(None),
+    ):
+    await async_operations.load_tasks()
+    start = last_event_id if last_event_id is not None else since
+    return StreamingResponse(change_events(start), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
 
 '''Search feature that allows users to find tasks based on a keyword present in the title or description'''
 @app.get("/tasks/search/{keyword}", response_model=list[TaskWithId])
-def search_tasks(request: Request, keyword: str, depends=Depends(enforce_version)):
-    tasks = read_all_tasks()
+async def search_tasks(
+    request: Request,
+    response: Response,
+    keyword: str,
+    limit: Optional[int] = Query(None, ge=1),
+    ):
     if not keyword:
         raise HTTPException(status_code=400, detail="Keyword must be provided")
-    # Filter tasks based on keyword in title or description
-    '''The expression (task.title.lower() + (task.description or "").lower()) concatenates the lowercase title with the lowercase description. If the description is None, it substitutes an empty string to avoid errors. The in operator then checks if the lowercase keyword is a substring of this combined text.'''
-    filtered_tasks = [
-        task for task in tasks
-        if keyword.lower() in (task.title.lower() + (task.description or "").lower())
-    ]
-    return filtered_tasks
+    await async_operations.load_tasks()
+    cached = dataset_not_modified(request, response)
+    if cached is not None:
+        return cached
+    '''The keyword is matched case-insensitively as a substring of the title followed by the description. Candidates come from an inverted index kept up to date by the write paths, ranked with whole-word title matches first, then description matches, then plain substring matches.'''
+    return cached_listing(request, response, task_list, search_tasks_by_keyword(keyword, limit))
+
+'''Task counts grouped by status and by priority, kept up to date by the write paths instead of counted per request'''
+@app.get("/tasks/stats", response_model=TaskStats)
+async def task_stats(request: Request, response: Response):
+    await async_operations.load_tasks()
+    # Counts are cheap to build, so they are only revalidated, never cached
+    version, last_modified = read_dataset_version()
+    cached = not_modified(request, response, make_etag(version), last_modified)
+    if cached is not None:
+        return cached
+    return read_task_stats()
+
+'''Type-ahead over titles: tasks whose title starts with prefix, ignoring case, in title order. Served from a sorted title index with one bisect, so the cost depends on limit rather than on the number of tasks.'''
+@app.get("/tasks/suggest", response_model=list[TaskWithId])
+async def suggest(
+    request: Request,
+    response: Response,
+    prefix: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=SUGGEST_MAX_LIMIT),
+    ):
+    await async_operations.load_tasks()
+    cached = dataset_not_modified(request, response)
+    if cached is not None:
+        return cached
+    return cached_listing(request, response, task_list, suggest_tasks(prefix, limit))
 
 @app.get("/tasks/{task_id}", response_model=TaskWithId)
-def get_task(request: Request, task_id: int, depends=Depends(enforce_version)):
+async def get_task(request: Request, response: Response, task_id: int):
+    await async_operations.load_tasks()
+    _, last_modified = read_dataset_version()
+    version = read_task_version(task_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    cached = not_modified(request, response, make_etag(task_id, version), last_modified)
+    if cached is not None:
+        return cached
     task = read_task_by_id(task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
 @app.post("/tasks", response_model=TaskWithId)
-def add_task(request: Request, task: Task, depends=Depends(enforce_version)):
-    return create_task(task)
+async def add_task(task: Task):
+    return await async_operations.create_task(task)
+
+'''Create, update and delete many tasks in one request; the whole batch is persisted with a single write'''
+@app.post("/tasks/bulk", response_model=list[BulkResult])
+async def bulk_tasks(operations: list[BulkOperation]):
+    return await async_operations.apply_bulk(operations)
 
 
 @app.put("/tasks/{task_id}", response_model=TaskWithId)
-def modify_task(request: Request, task_id: int, updated_task: UpdateTask, depends=Depends(enforce_version)):
-    task = update_task(task_id, updated_task)
+async def modify_task(task_id: int, updated_task: UpdateTask):
+    task = await async_operations.update_task(task_id, updated_task)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    return task
+
+'''Change only the fields present in the body; the cost does not depend on how many tasks exist'''
+@app.patch("/tasks/{task_id}", response_model=TaskWithId)
+async def patch_task(task_id: int, patch: PatchTask):
+    task = await async_operations.patch_task(task_id, patch)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
 @app.delete("/tasks/{task_id}")
-def delete_task(request: Request, task_id: int, depends=Depends(enforce_version)):
-    tasks = read_all_tasks()
-    # Check if task exists
-    task_exists = any(task.id == task_id for task in tasks)
-    if not task_exists:
+async def delete_task(task_id: int):
+    if not await async_operations.delete_task(task_id):
         raise HTTPException(status_code=404, detail="Task not found")
-    # Remove the task
-    tasks = [task for task in tasks if task.id != task_id]
-    with open('tasks.csv', mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['id', 'title', 'description', 'status', 'priority'])
-        writer.writeheader()
-        for task in tasks:
-            writer.writerow(task.model_dump())
     return {"message": "Task deleted successfully"}
 
+'''Hit, miss, eviction and invalidation counters of the listing cache'''
+@app.get("/cache/stats")
+async def cache_stats():
+    return response_cache.stats()
+
 @app.get("/v2/tasks", response_model=list[TaskV2WithId])
-def get_tasks_v2():
-    tasks = read_all_tasks_v2()
-    return tasks
\ No newline at end of file
+async def get_tasks_v2(
+    request: Request,
+    response: Response,
+    status: Optional[str] = None,
+    title: Optional[str] = None,
+    priority: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    after: Optional[str] = None,
+    ):
+    await async_operations.load_tasks()
+    after_id = decode_cursor(after)
+    cached = dataset_not_modified(request, response)
+    if cached is not None:
+        return cached
+    if not (status or title or priority or limit or after):
+        return cached_listing(request, response, task_v2_list, read_all_tasks_v2())
+    tasks, has_more = read_tasks_page_v2(
+        after=after_id, limit=limit,
+        status=status or None, title=title or None, priority=priority or None,
+    )
+    set_next_page(request, response, tasks, has_more)
+    return cached_listing(request, response, task_v2_list, tasks)
+
+# Registered last, once every route exists, so it can mirror them
+app.add_middleware(ApiVersionMiddleware, routes=app.routes)
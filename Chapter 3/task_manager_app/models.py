@@ -1,5 +1,5 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import Annotated, Literal, Optional, Union
 class Task(BaseModel):
     title: str
     description: Optional[str] = None
@@ -19,4 +19,59 @@ class TaskV2WithId(TaskV2):
 class UpdateTask(BaseModel):
     title: str
     description: str | None = None
-    status: str | None = None
\ No newline at end of file
+    status: str | None = None
+class PatchTask(BaseModel):
+    '''Sparse update: only the fields sent are changed, and null clears description or status'''
+    title: str | None = None
+    description: str | None = None
+    status: str | None = None
+
+    @field_validator("title")
+    @classmethod
+    def title_not_null(cls, value):
+        if value is None:
+            raise ValueError("title cannot be null")
+        return value
+
+class BulkCreate(BaseModel):
+    op: Literal["create"]
+    task: Task
+class BulkUpdate(BaseModel):
+    op: Literal["update"]
+    id: int
+    task: UpdateTask
+class BulkDelete(BaseModel):
+    op: Literal["delete"]
+    id: int
+BulkOperation = Annotated[Union[BulkCreate, BulkUpdate, BulkDelete], Field(discriminator="op")]
+class BulkResult(BaseModel):
+    op: str
+    status_code: int
+    id: Optional[int] = None
+    task: Optional[TaskWithId] = None
+    detail: Optional[str] = None
+class TaskChange(BaseModel):
+    seq: int
+    op: Literal["create", "update", "delete"]
+    id: int
+    task: Optional[TaskWithId] = None
+class ChangeBatch(BaseModel):
+    '''Changes after the requested cursor; with reset set they are no longer
+    available and the client has to fetch the full listing again. Sequence
+    numbers are counted by each worker, so the cursor to continue from also
+    names the worker's epoch: "<epoch>:<seq>".'''
+    epoch: str
+    seq: int
+    cursor: str
+    reset: bool = False
+    changes: list[TaskChange] = []
+class StatusCount(BaseModel):
+    status: Optional[str] = None
+    count: int
+class PriorityCount(BaseModel):
+    priority: Optional[str] = None
+    count: int
+class TaskStats(BaseModel):
+    total: int
+    by_status: list[StatusCount]
+    by_priority: list[PriorityCount]
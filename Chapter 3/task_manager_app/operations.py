@@ -1,101 +1,223 @@
-import csv
-from typing import List, Optional
-from models import Task, TaskWithId, TaskV2, TaskV2WithId
+import os
+from typing import Iterator, List, Optional
+from models import Task, TaskWithId, TaskV2WithId, PatchTask, BulkResult, TaskChange, ChangeBatch
+from models import TaskStats, StatusCount, PriorityCount
+from change_feed import ChangeEvent
+from storage import open_storage
+from store import TaskRecord, TaskStore
 
 DATABASE_FILENAME = 'tasks.csv'
-columns = ['id', 'title', 'description', 'status']
+# "csv" keeps tasks in DATABASE_FILENAME; "sqlite" in a database next to it;
+# "sharded" in several CSV shards next to it, each with its own lock and log
+STORAGE_BACKEND = os.environ.get('TASKS_STORAGE_BACKEND', 'csv')
+columns = ['id', 'title', 'description', 'status', 'priority']
+EXPORT_BATCH_SIZE = 500
+task_store = TaskStore(columns)
+_loaded_from = None
+
+def needs_load() -> bool:
+    return _loaded_from != (STORAGE_BACKEND, DATABASE_FILENAME)
+
+def load_tasks() -> TaskStore:
+    '''Return the in-memory store, (re)loading it if the configured storage changed'''
+    global _loaded_from
+    if needs_load():
+        source = (STORAGE_BACKEND, DATABASE_FILENAME)
+        task_store.load(open_storage(STORAGE_BACKEND, DATABASE_FILENAME, columns))
+        _loaded_from = source
+    elif task_store.is_stale():
+        task_store.refresh()  # another worker wrote; replay its changes
+    return task_store
+
+def current_tasks() -> TaskStore:
+    '''The store for a read: loaded on first use, but never caught up with
+    other workers here. Reads run on the event loop, which must not wait
+    for the disk; async_operations.load_tasks() and the write paths catch up.'''
+    if needs_load():
+        return load_tasks()
+    return task_store
+
+def close_tasks() -> None:
+    global _loaded_from
+    task_store.close()
+    _loaded_from = None
+
 def read_all_tasks() -> list[TaskWithId]:
-    tasks = []
-    try:
-        with open(DATABASE_FILENAME, mode='r', newline='') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                row['id'] = int(row['id'])  # Convert id to int
-                task = TaskWithId(**row)
-                tasks.append(task)
-    except FileNotFoundError:
-        pass  # If the file does not exist, return an empty list
-    return tasks
+    return current_tasks().all()
 
 def read_task_by_id(task_id: int) -> Optional[TaskWithId]:
-    with open(DATABASE_FILENAME, mode='r', newline='') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if int(row['id']) == task_id:
-                row['id'] = int(row['id'])  # Convert id to int
-                return TaskWithId(**row)
+    return current_tasks().get(task_id)
+
+'''Version and modification time of the whole task set; the version changes with every
+write and is the same in every worker that has caught up with it'''
+def read_dataset_version() -> tuple[str, float]:
+    return current_tasks().current_version()
+
+'''Version at which a task last changed, or None if it does not exist'''
+def read_task_version(task_id: int) -> Optional[str]:
+    return current_tasks().task_version(task_id)
+
+'''Cursor a client passes back to get the changes after seq'''
+def change_cursor(seq: int) -> str:
+    return f'{current_tasks().epoch}:{seq}'
+
+'''Sequence number in a cursor from change_cursor(); None if another worker, or an earlier run of this one, handed it out'''
+def parse_change_cursor(cursor: str) -> Optional[int]:
+    epoch, _, seq = cursor.partition(':')
+    if epoch != current_tasks().epoch or not seq.isdigit():
+        return None
+    return int(seq)
+
+'''Response for the changes after since, as returned by ChangeFeed.since(); None means the client must resync'''
+def change_batch(since: Optional[int], changes: Optional[list[ChangeEvent]]) -> ChangeBatch:
+    store = current_tasks()
+    if changes is None:
+        seq = store.feed.seq
+        return ChangeBatch(epoch=store.epoch, seq=seq, cursor=f'{store.epoch}:{seq}', reset=True)
+    seq = changes[-1].seq if changes else since
+    return ChangeBatch(epoch=store.epoch, seq=seq, cursor=f'{store.epoch}:{seq}',
+                       changes=[to_change(change) for change in changes])
+
+def to_change(change: ChangeEvent) -> TaskChange:
+    task = change.task.to_task() if change.task is not None else None
+    return TaskChange.model_construct(seq=change.seq, op=change.op, id=change.id, task=task)
+
+def largest_first(counts: dict[Optional[str], int]) -> list[tuple[Optional[str], int]]:
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0] is None, item[0] or ''))
+
+'''Task counts by status and by priority; the cost depends on the number of groups, not of tasks'''
+def read_task_stats() -> TaskStats:
+    total, by_status, by_priority = current_tasks().counts()
+    return TaskStats.model_construct(
+        total=total,
+        by_status=[StatusCount.model_construct(status=status, count=count) for status, count in largest_first(by_status)],
+        by_priority=[PriorityCount.model_construct(priority=priority, count=count)
+                     for priority, count in largest_first(by_priority)],
+    )
+
+'''Ranked keyword search over title and description'''
+def search_tasks_by_keyword(keyword: str, limit: Optional[int] = None) -> list[TaskWithId]:
+    return current_tasks().search(keyword, limit)
+
+'''Tasks whose title starts with prefix, case-insensitively, in title order'''
+def suggest_tasks(prefix: str, limit: int) -> list[TaskWithId]:
+    return current_tasks().suggest(prefix, limit)
             
-def get_next_id():
-    try:
-        with open(DATABASE_FILENAME, mode='r', newline='') as file:
-            reader = csv.DictReader(file)
-            rows = list(reader)
-            if rows:
-                return int(rows[-1]['id']) + 1
-    except FileNotFoundError:
-        return 1
+'''Id the next created task will get'''
+def get_next_id() -> int:
+    return load_tasks().next_id()
 
 '''Create new task'''
 def create_task(task: Task) -> TaskWithId:
-    tasks = read_all_tasks()
-    task_id = task.id if task.id is not None else max((t.id for t in tasks), default=0) + 1
-    task_with_id = TaskWithId(id=task_id, **task.dict(exclude={"id"}))
-    tasks.append(task_with_id)
-
-    with open(DATABASE_FILENAME, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=['id', 'title', 'description', 'status'])
-        writer.writeheader()
-        for t in tasks:
-            writer.writerow(t.model_dump())
-
+    store = load_tasks()
+    # Ids always come from the allocator; one sent by the client is ignored
+    with store.new_task_id() as task_id:
+        task_with_id = TaskWithId(id=task_id, **task.model_dump(exclude={"id"}))
+        store.put(task_with_id)
     return task_with_id
 
 '''Update existing task'''
 def update_task(task_id: int, updated_task) -> Optional[TaskWithId]:
-    tasks = read_all_tasks()
-    for i, task in enumerate(tasks):
-        if task.id == task_id:
-            # Get the current task data
-            task_data = task.model_dump()
-            # Update only the fields that are provided (not None)
-            update_data = updated_task.model_dump(exclude_unset=False)
-            for field, value in update_data.items():
-                if value is not None:
-                    task_data[field] = value
-            # Create the updated task with id
-            updated_task_with_id = TaskWithId(**task_data)
-            tasks[i] = updated_task_with_id
-            break
-    else:
-        return None
-
-    with open(DATABASE_FILENAME, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=columns)
-        writer.writeheader()
-        for task in tasks:
-            writer.writerow(task.model_dump())
+    store = load_tasks()
+    with store.locked([task_id]):
+        task = store.get(task_id)
+        if task is None:
+            return None
+        updated_task_with_id = merge_update(task, updated_task)
+        store.put(updated_task_with_id)
     return updated_task_with_id
 
+'''Apply a sparse diff to one task; only that task's record is persisted'''
+def patch_task(task_id: int, patch: PatchTask) -> Optional[TaskWithId]:
+    store = load_tasks()
+    with store.locked([task_id]):
+        task = store.get(task_id)
+        if task is None:
+            return None
+        changes = patch.model_dump(exclude_unset=True)
+        if not changes:
+            return task
+        # The diff was validated field by field already
+        patched = task.model_copy(update=changes)
+        store.put(patched)
+    return patched
+
+def merge_update(task: TaskWithId, updated_task) -> TaskWithId:
+    # Get the current task data
+    task_data = task.model_dump()
+    # Update only the fields that are provided (not None)
+    update_data = updated_task.model_dump(exclude_unset=False)
+    for field, value in update_data.items():
+        if value is not None:
+            task_data[field] = value
+    # Create the updated task with id
+    return TaskWithId(**task_data)
+
 '''Delete task by ID'''
 def delete_task(task_id: int) -> bool:
-    tasks = read_all_tasks()
-    tasks = [task for task in tasks if task.id != task_id]
-    with open(DATABASE_FILENAME, mode='w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=columns)
-        writer.writeheader()
-        for task in tasks:
-            writer.writerow(task.model_dump())
-    return len(tasks) < len(tasks)
+    return load_tasks().remove(task_id)
+
+'''Apply a batch of create/update/delete operations with a single write.
+
+Operations run in order, so later ones see tasks created earlier in the
+same batch. Each one gets its own result; a missing id fails only that
+item. Everything that succeeded is persisted with one log append.'''
+def apply_bulk(bulk_operations: list) -> list[BulkResult]:
+    store = load_tasks()
+    with store.locked():
+        pending: dict[int, Optional[TaskWithId]] = {}
+        changes, results = [], []
+
+        def current(task_id: int) -> Optional[TaskWithId]:
+            return pending[task_id] if task_id in pending else store.get(task_id)
+
+        for operation in bulk_operations:
+            if operation.op == "create":
+                task = TaskWithId(id=store.allocate_id(), **operation.task.model_dump(exclude={"id"}))
+            elif current(operation.id) is None:
+                results.append(BulkResult(op=operation.op, status_code=404, id=operation.id, detail="Task not found"))
+                continue
+            elif operation.op == "update":
+                task = merge_update(current(operation.id), operation.task)
+            else:
+                task = None
+            task_id = operation.id if task is None else task.id
+            pending[task_id] = task
+            changes.append((task_id, task))
+            results.append(BulkResult(op=operation.op, status_code=200, id=task_id, task=task))
+        store.write_batch(changes)
+    return results
+
+'''Filter tasks through the store's status and title indexes'''
+def filter_tasks(status: Optional[str] = None, title: Optional[str] = None) -> list[TaskWithId]:
+    return current_tasks().filter(status=status, title=title)
+
+'''Page through tasks in id order, starting after the given id'''
+def read_tasks_page(after: Optional[int] = None, limit: Optional[int] = None,
+                    status: Optional[str] = None, title: Optional[str] = None) -> tuple[list[TaskWithId], bool]:
+    return current_tasks().page(after=after, limit=limit, status=status, title=title)
+
+'''Yield every task in id order, one page at a time, without materialising the full list'''
+def iter_tasks(batch_size: Optional[int] = None) -> Iterator[TaskWithId]:
+    store = current_tasks()
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    after = None
+    while True:
+        tasks, has_more = store.page(after=after, limit=batch_size)
+        yield from tasks
+        if not has_more or not tasks:
+            return
+        after = tasks[-1].id
+
+def read_tasks_page_v2(after: Optional[int] = None, limit: Optional[int] = None,
+                       status: Optional[str] = None, title: Optional[str] = None,
+                       priority: Optional[str] = None) -> tuple[List[TaskV2WithId], bool]:
+    return current_tasks().page(after=after, limit=limit, status=status, title=title, priority=priority,
+                             project=TaskRecord.to_task_v2)
 
 def read_all_tasks_v2() -> List[TaskV2WithId]:
-    tasks = []
-    try:
-        with open(DATABASE_FILENAME, mode='r', newline='') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                row['id'] = int(row['id'])  # Convert id to int
-                task = TaskV2WithId(**row)
-                tasks.append(task)
-    except FileNotFoundError:
-        pass  # If the file does not exist, return an empty list
-    return tasks
\ No newline at end of file
+    return filter_tasks_v2()
+
+def filter_tasks_v2(status: Optional[str] = None, title: Optional[str] = None,
+                    priority: Optional[str] = None) -> List[TaskV2WithId]:
+    return current_tasks().filter(status=status, title=title, priority=priority, project=TaskRecord.to_task_v2)
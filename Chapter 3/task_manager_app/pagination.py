@@ -0,0 +1,41 @@
+"""Opaque keyset cursors for the task listings.
+
+A cursor wraps the id of the last task on a page; the next page starts
+right after it, so walking the whole set never rescans earlier rows."""
+
+import base64
+import binascii
+from typing import Optional
+from fastapi import HTTPException, Request, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(task_id: int) -> str:
+    return base64.urlsafe_b64encode(f"id:{task_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, _, task_id = raw.partition(":")
+        if prefix != "id":
+            raise ValueError(raw)
+        return int(task_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def set_next_page(request: Request, response: Response, tasks: list, has_more: bool) -> None:
+    '''Advertise the next page through the X-Next-Cursor and Link headers'''
+    if not has_more or not tasks:
+        return
+    set_next_cursor(request, response, encode_cursor(tasks[-1].id))
+
+
+def set_next_cursor(request: Request, response: Response, cursor: str) -> None:
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    next_url = request.url.include_query_params(after=cursor)
+    response.headers["Link"] = f'<{next_url}>; rel="next"'
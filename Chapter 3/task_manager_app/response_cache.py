@@ -0,0 +1,93 @@
+"""LRU cache of encoded task listings.
+
+Entries are keyed by route and query parameters and belong to one
+generation, the dataset ETag they were built under. Every mutation bumps
+the dataset version and with it the ETag, so the first lookup under a new
+generation drops everything cached for the old one; a hit is therefore
+always the body the route would have built right now.
+
+The cache is bounded by the bytes it holds rather than by its number of
+entries, since one unfiltered listing can outweigh thousands of small
+pages. A body too large for its share of the budget is not cached at all,
+so it cannot flush everything else out."""
+
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+# Total size of the cached bodies, and the largest body worth caching
+RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+RESPONSE_CACHE_ENTRY_BYTES = RESPONSE_CACHE_BYTES // 16
+
+
+class ResponseCache:
+    def __init__(self, maxbytes: int = RESPONSE_CACHE_BYTES, max_entry_bytes: int = RESPONSE_CACHE_ENTRY_BYTES):
+        self.maxbytes = maxbytes
+        self.max_entry_bytes = max_entry_bytes
+        # key -> (value, size in bytes)
+        self._entries: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self._generation: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.oversized = 0
+
+    def _switch(self, generation: Hashable) -> None:
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+                self._entries.clear()
+                self._bytes = 0
+            self._generation = generation
+
+    def get(self, generation: Hashable, key: Hashable):
+        with self._lock:
+            self._switch(generation)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, generation: Hashable, key: Hashable, value, size: int) -> None:
+        '''Cache value, whose body takes size bytes, evicting the least
+        recently used entries until the budget holds it'''
+        with self._lock:
+            self._switch(generation)
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            if size > self.max_entry_bytes:
+                self.oversized += 1
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.maxbytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._generation = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "maxbytes": self.maxbytes,
+                "max_entry_bytes": self.max_entry_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "oversized": self.oversized,
+            }
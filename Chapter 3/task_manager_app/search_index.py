@@ -0,0 +1,382 @@
+import bisect
+import heapq
+import re
+from array import array
+from itertools import filterfalse, islice, takewhile
+from typing import Collection, Iterable, Iterator, Mapping, Optional, Sequence
+
+TOKEN_PATTERN = re.compile(r'\w+')
+# Only n-grams of this length are indexed; shorter keywords are answered
+# from the n-grams that contain them
+NGRAM_SIZE = 3
+# Below one candidate per this many ids in a posting, candidates are looked
+# up in it by bisection instead of intersecting the whole posting
+BISECT_RATIO = 32
+
+# Ranking weights: whole-word hits beat substring hits, title beats description
+TITLE_WORD_SCORE = 4
+DESCRIPTION_WORD_SCORE = 2
+TITLE_SUBSTRING_SCORE = 1
+
+
+def tokenize(text: str) -> set[str]:
+    return set(TOKEN_PATTERN.findall(text))
+
+
+def ngrams(text: str, size: int) -> set[str]:
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def searchable(task) -> str:
+    return task.title.lower() + (task.description or "").lower()
+
+
+def contains(posting: array, task_id: int) -> bool:
+    position = bisect.bisect_left(posting, task_id)
+    return position < len(posting) and posting[position] == task_id
+
+
+def build_postings(tasks: Iterable) -> tuple[dict[str, list[int]], dict[str, list[int]], list[int]]:
+    '''What SearchIndex.add() indexes for tasks given in ascending id order,
+    as plain lists: the word and trigram postings, and the ids of the tasks
+    without any trigram'''
+    word_postings: dict[str, list[int]] = {}
+    gram_postings: dict[str, list[int]] = {}
+    short = []
+    for task in tasks:
+        grams = ngrams(searchable(task), NGRAM_SIZE)
+        if not grams:
+            short.append(task.id)
+        for key in words(task):
+            word_postings.setdefault(key, []).append(task.id)
+        for key in grams:
+            gram_postings.setdefault(key, []).append(task.id)
+    return word_postings, gram_postings, short
+
+
+class LayeredPosting:
+    '''Sorted task ids in two layers: the ids of base, a posting read in
+    place from a binary snapshot, except those in hidden; then the ids of
+    overlay, added by this process since the snapshot was read.
+
+    hidden holds the tasks whose snapshot state no longer holds, and is
+    shared by every posting over the same snapshot; hidden_count is how
+    many of them base has. A task changed since keeps its snapshot entry
+    hidden and gets an overlay entry, so the snapshot, mapped by every
+    worker, is never copied or written. Any sorted sequence of ids can be
+    a base with nothing on top.'''
+
+    __slots__ = ('base', 'overlay', 'hidden', 'hidden_count')
+
+    def __init__(self, base: Sequence[int] = (), overlay: Sequence[int] = (), hidden: Collection[int] = frozenset(),
+                 hidden_count: int = 0):
+        self.base = base
+        self.overlay = overlay
+        self.hidden = hidden
+        self.hidden_count = hidden_count
+
+    def __len__(self) -> int:
+        return len(self.base) - self.hidden_count + len(self.overlay)
+
+    def __contains__(self, task_id: int) -> bool:
+        return contains(self.overlay, task_id) or (contains(self.base, task_id) and task_id not in self.hidden)
+
+    def __iter__(self) -> Iterator[int]:
+        if not self.overlay and not self.hidden_count:
+            return iter(self.base)
+        return self.after(None)
+
+    def after(self, task_id: Optional[int]) -> Iterator[int]:
+        '''The ids above task_id, or all of them for None, in ascending order'''
+        base, overlay = self.base, self.overlay
+        position = 0 if task_id is None else bisect.bisect_right(base, task_id)
+        start = 0 if task_id is None else bisect.bisect_right(overlay, task_id)
+        for added in islice(overlay, start, None):
+            end = bisect.bisect_left(base, added, position)
+            yield from self._visible(base[position:end])
+            yield added
+            position = end
+        yield from self._visible(base[position:])
+
+    def _visible(self, ids: Sequence[int]) -> Iterable[int]:
+        return filterfalse(self.hidden.__contains__, ids) if self.hidden_count else ids
+
+    def last(self) -> Optional[int]:
+        '''The largest id, or None when there is none'''
+        base, position = self.base, len(self.base)
+        if self.hidden_count:
+            while position and base[position - 1] in self.hidden:
+                position -= 1
+        candidates = [base[position - 1]] if position else []
+        if self.overlay:
+            candidates.append(self.overlay[-1])
+        return max(candidates, default=None)
+
+    def add(self, task_id: int) -> None:
+        '''Add an id not in the posting; overlay must be an array'''
+        overlay = self.overlay
+        if not overlay or overlay[-1] < task_id:
+            overlay.append(task_id)  # new ids normally come last
+        else:
+            bisect.insort(overlay, task_id)
+
+    def remove(self, task_id: int) -> None:
+        '''Remove an id in the posting. One only in base is counted as
+        hidden; the caller adds it to hidden.'''
+        overlay = self.overlay
+        position = bisect.bisect_left(overlay, task_id)
+        if position < len(overlay) and overlay[position] == task_id:
+            del overlay[position]
+        else:
+            self.hidden_count += 1
+
+
+class LayeredPostings:
+    '''key -> LayeredPosting, over the postings of a binary snapshot when
+    there is one. Only keys changed since the snapshot have a posting
+    object of their own; the others are looked up in the snapshot.'''
+
+    def __init__(self, base=None, hidden: Collection[int] = frozenset()):
+        # binary_snapshot.Postings, or None
+        self.base = base
+        self.hidden = hidden
+        self._changed: dict = {}
+
+    def posting(self, key) -> LayeredPosting:
+        '''The posting of key, empty for a key without one'''
+        posting = self._changed.get(key)
+        if posting is None:
+            posting = LayeredPosting(self._base_posting(key), (), self.hidden)
+        return posting
+
+    def _base_posting(self, key) -> Sequence[int]:
+        return self.base.get(key) if self.base is not None else ()
+
+    def _changing(self, key) -> LayeredPosting:
+        posting = self._changed.get(key)
+        if posting is None:
+            posting = self._changed[key] = LayeredPosting(self._base_posting(key), array('q'), self.hidden)
+        return posting
+
+    def add(self, key, task_id: int) -> None:
+        posting = self._changed.get(key)
+        if posting is None:
+            posting = self._changing(key)
+        overlay = posting.overlay
+        if overlay and task_id < overlay[-1]:
+            posting.add(task_id)
+        else:
+            overlay.append(task_id)  # the usual case, and all of a load
+
+    def remove(self, key, task_id: int) -> None:
+        posting = self._changing(key)
+        posting.remove(task_id)
+        if not posting.overlay and not posting.hidden_count:
+            del self._changed[key]  # back to what the snapshot, if any, has
+
+    def items(self) -> Iterator[tuple[object, LayeredPosting]]:
+        '''Every key with at least one id, and its posting'''
+        changed = self._changed
+        if self.base is not None:
+            for key, ids in self.base.items():
+                if key not in changed:
+                    yield key, LayeredPosting(ids, (), self.hidden)
+        for key, posting in changed.items():
+            if posting:
+                yield key, posting
+
+    def __iter__(self) -> Iterator:
+        return (key for key, _ in self.items())
+
+    def values(self) -> Iterator[LayeredPosting]:
+        return (posting for _, posting in self.items())
+
+    def containing(self, fragment: str) -> Iterator[LayeredPosting]:
+        '''Postings of the keys containing fragment'''
+        changed = self._changed
+        if self.base is not None:
+            for key, ids in self.base.containing(fragment):
+                if key not in changed:
+                    yield LayeredPosting(ids, (), self.hidden)
+        for key, posting in changed.items():
+            if fragment in key and posting:
+                yield posting
+
+
+def words(task) -> set[str]:
+    return tokenize(task.title.lower()) | tokenize((task.description or "").lower())
+
+
+class SearchIndex:
+    '''Word and trigram index over task titles and descriptions.
+
+    Every word, and every trigram of the lowercased title followed by the
+    lowercased description, maps to the sorted ids of the tasks containing
+    it, packed in an array of machine integers. The trigrams keep the
+    original substring semantics of the search endpoint: a keyword of three
+    or more characters is looked up through its trigrams, a shorter one
+    through the trigrams containing it, plus the few tasks whose text is
+    too short to have any. The words only serve ranking. The index holds
+    no text; candidates are checked against the tasks passed to search().
+
+    An index read from a binary snapshot leaves its postings in the
+    mapping, shared with every worker, and keeps only what changed since
+    (see LayeredPosting).'''
+
+    def __init__(self):
+        self._words = LayeredPostings()
+        self._grams = LayeredPostings()
+        # Tasks whose text has no trigram at all
+        self._short = LayeredPosting((), array('q'))
+
+    @classmethod
+    def from_snapshot(cls, snapshot, hidden: Collection[int]) -> 'SearchIndex':
+        '''The index of the tasks in an indexed binary snapshot, read from
+        the postings stored in it; hidden holds the tasks changed since'''
+        index = cls()
+        index._words = LayeredPostings(snapshot.postings['words'], hidden)
+        index._grams = LayeredPostings(snapshot.postings['grams'], hidden)
+        index._short = LayeredPosting(snapshot.short, array('q'), hidden)
+        return index
+
+    def add(self, task) -> None:
+        '''Index a task not in the index yet (anything with id, title and description)'''
+        task_id = task.id
+        grams = ngrams(searchable(task), NGRAM_SIZE)
+        if not grams:
+            self._short.add(task_id)
+        for postings, keys in ((self._words, words(task)), (self._grams, grams)):
+            for key in keys:
+                postings.add(key, task_id)
+
+    def remove(self, task) -> None:
+        '''Unindex a task, given as it was when added'''
+        grams = ngrams(searchable(task), NGRAM_SIZE)
+        if not grams:
+            self._short.remove(task.id)
+        for postings, keys in ((self._words, words(task)), (self._grams, grams)):
+            for key in keys:
+                postings.remove(key, task.id)
+
+    def search(self, keyword: str, tasks: Mapping[int, object], limit: Optional[int] = None) -> list[int]:
+        '''Return the ids of matching tasks, best match first; tasks maps
+        each indexed id to the task as it was added'''
+        keyword = keyword.lower()
+        candidates, unverified = self._candidates(keyword)
+        word_hits = set(self._words.posting(keyword))
+        scored = []
+        for task_id in candidates:
+            task = tasks[task_id]
+            title = task.title.lower()
+            if (task_id in unverified and keyword not in title
+                    and keyword not in title + (task.description or "").lower()):
+                continue
+            score = TITLE_SUBSTRING_SCORE if keyword in title else 0
+            if task_id in word_hits:
+                score += TITLE_WORD_SCORE if keyword in tokenize(title) else DESCRIPTION_WORD_SCORE
+            scored.append((-score, task_id))
+        if limit is not None:
+            ranked = heapq.nsmallest(limit, scored)
+        else:
+            ranked = sorted(scored)
+        return [task_id for _, task_id in ranked]
+
+    def _candidates(self, keyword: str) -> tuple[set[int], Collection[int]]:
+        '''Ids that may contain keyword, and those of them that still need
+        the substring check'''
+        if len(keyword) < NGRAM_SIZE:
+            # Any occurrence in a text of three or more characters lies
+            # within one of its trigrams, so only the short texts need a check
+            candidates = set(self._short)
+            for posting in self._grams.containing(keyword):
+                candidates.update(posting)
+            return candidates, self._short
+        # Intersect the trigram postings smallest first; what survives still
+        # needs the substring check because trigrams may appear out of order
+        postings = sorted((self._grams.posting(gram) for gram in ngrams(keyword, NGRAM_SIZE)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            if len(candidates) * BISECT_RATIO < len(posting):
+                # Few candidates left: look them up rather than scan the posting
+                candidates = {task_id for task_id in candidates if task_id in posting}
+            else:
+                candidates.intersection_update(posting)
+        return candidates, candidates
+
+
+class TitleIndex:
+    '''Task titles in case-insensitive sorted order, for type-ahead.
+
+    Entries are (casefolded title, id) pairs in one sorted list. The tasks
+    whose title starts with a prefix form a contiguous run of it, found
+    with one bisect, so a lookup costs O(log n + limit) however many tasks
+    there are. Adds and removes keep the list sorted; a bulk load appends
+    everything and sorts once.
+
+    Read from a binary snapshot, the snapshot's sorted titles are searched
+    in place, skipping the hidden tasks, and the list only holds the titles
+    of tasks changed since; lookups merge the two runs.'''
+
+    def __init__(self):
+        self._entries: list[tuple[str, int]] = []
+        # binary_snapshot.Titles, or None
+        self._base = None
+        self._hidden: Collection[int] = frozenset()
+
+    @classmethod
+    def from_snapshot(cls, snapshot, hidden: Collection[int]) -> 'TitleIndex':
+        '''The titles of an indexed binary snapshot; hidden holds the tasks
+        changed since'''
+        index = cls()
+        index._base = snapshot.titles
+        index._hidden = hidden
+        return index
+
+    def add(self, title: str, task_id: int) -> None:
+        bisect.insort(self._entries, (title.casefold(), task_id))
+
+    def append(self, title: str, task_id: int) -> None:
+        '''Add without keeping the order; call sort() once done'''
+        self._entries.append((title.casefold(), task_id))
+
+    def sort(self) -> None:
+        self._entries.sort()
+
+    def remove(self, title: str, task_id: int) -> None:
+        '''Remove a title; one only in the snapshot is left to the caller to hide'''
+        entry = (title.casefold(), task_id)
+        position = bisect.bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def matching(self, title: str) -> list[int]:
+        '''Ids of the tasks whose title equals title ignoring case, in id order'''
+        key = title.casefold()
+        return [task_id for _, task_id in self._run(key, key.__eq__)]
+
+    def suggest(self, prefix: str, limit: int) -> list[int]:
+        '''Ids of up to limit tasks whose title starts with prefix, in title order'''
+        prefix = prefix.casefold()
+        return [task_id for _, task_id in islice(self._run(prefix, lambda key: key.startswith(prefix)), limit)]
+
+    def _run(self, key: str, matches) -> Iterator[tuple[str, int]]:
+        '''The entries from key on while matches(title) holds, in order'''
+        entries = self._entries
+        position = bisect.bisect_left(entries, (key,))
+        run = takewhile(lambda entry: matches(entry[0]), islice(entries, position, None))
+        if self._base is None:
+            return run
+        return heapq.merge(self._base_run(key, matches), run)
+
+    def _base_run(self, key: str, matches) -> Iterator[tuple[str, int]]:
+        keys, ids, hidden = self._base.keys, self._base.ids, self._hidden
+        position = bisect.bisect_left(keys, key.encode())
+        while position < len(keys):
+            title = keys.text(position)
+            if not matches(title):
+                return
+            if ids[position] not in hidden:
+                yield title, ids[position]
+            position += 1
@@ -0,0 +1,19 @@
+"""Fast JSON encoding for the task listings.
+
+Tasks in the store were validated when they were written (or were loaded
+from files only this app writes), so the listings skip FastAPI's
+response_model pass, which would validate every row again before
+encoding it. A TypeAdapter per list type encodes the whole list to bytes
+in one call instead."""
+
+from fastapi import Response
+from pydantic import TypeAdapter
+from models import TaskWithId, TaskV2WithId
+
+task_list = TypeAdapter(list[TaskWithId])
+task_v2_list = TypeAdapter(list[TaskV2WithId])
+
+
+def json_response(adapter: TypeAdapter, tasks: list, response: Response) -> Response:
+    '''Encode tasks as the response body, keeping headers already set on response'''
+    return Response(adapter.dump_json(tasks), media_type="application/json", headers=response.headers)
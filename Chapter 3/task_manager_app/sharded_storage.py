@@ -0,0 +1,234 @@
+import csv
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Collection, Iterable, Iterator, Optional
+from locks import FileLock
+from storage import CsvStorage, TaskStorage, columns_to_rows
+from wal import fsync_directory
+
+# Number of shards a new sharded store is split into
+SHARD_COUNT = int(os.environ.get('TASKS_SHARDS', '4'))
+
+
+class ShardedStorage(TaskStorage):
+    '''Tasks spread over shard_count CsvStorage shards by id modulo shard_count.
+
+    Shard i is <filename>.shard<i> with its own log, lock, id high-water
+    mark and commit counter. A write locks, appends to and fsyncs only the
+    shards its tasks live in, so writers in other processes working on
+    other shards carry on meanwhile, and compaction rewrites only the
+    shards whose log outgrew the threshold.
+
+    Each shard hands out the ids congruent to its number, above its own
+    high-water mark, so a create needs no lock beyond its shard's.
+    <filename>.shards records the shard count; the first process to open a
+    sharded store splits the existing <filename>, if any, into the shards.'''
+
+    writes_snapshots = True
+
+    def __init__(self, filename: str, columns: list[str], shard_count: Optional[int] = None, **shard_options):
+        self.filename = filename
+        self.columns = columns
+        self.manifest_path = filename + '.shards'
+        # An existing store keeps the count it was split with
+        self.shard_count = self._open_manifest(shard_count or SHARD_COUNT)
+        # Shards are loaded column by column and merged, never from their indexes
+        self.shards = [CsvStorage(self.shard_path(index), columns, index_snapshots=False, **shard_options)
+                       for index in range(self.shard_count)]
+        # Shards whose file lock this process holds
+        self._held: list[int] = []
+        # Ids each shard has reported, to tell what went missing when one
+        # has to be read again after another process compacted it
+        self._ids: list[set[int]] = [set() for _ in self.shards]
+        # Shards the current thread appended to and has not synced yet
+        self._unsynced = threading.local()
+
+    def shard_path(self, index: int) -> str:
+        return f'{self.filename}.shard{index}'
+
+    def shard_of(self, task_id: int) -> int:
+        return task_id % self.shard_count
+
+    def _open_manifest(self, shard_count: int) -> int:
+        lock = FileLock(self.manifest_path + '.lock')
+        lock.acquire()
+        try:
+            try:
+                with open(self.manifest_path) as file:
+                    return int(file.read())
+            except FileNotFoundError:
+                pass
+            self._split(shard_count)
+            temp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+            with open(temp_path, mode='w') as file:
+                file.write(str(shard_count))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.manifest_path)
+            fsync_directory(self.manifest_path)
+            return shard_count
+        finally:
+            lock.release()
+            lock.close()
+
+    def _split(self, shard_count: int) -> None:
+        '''Seed the shards from the unsharded CSV and its log'''
+        source = CsvStorage(self.filename, self.columns, binary_snapshots=False)
+        try:
+            rows = source.load()
+            high_water = source.high_water_mark()
+        finally:
+            source.close()
+        for index in range(shard_count):
+            path = self.shard_path(index)
+            with open(path, mode='w', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=self.columns, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(row for row in rows if row['id'] % shard_count == index)
+                file.flush()
+                os.fsync(file.fileno())
+            # Every shard starts above the ids the unsharded file ever used
+            with open(path + '.ids', mode='w') as file:
+                file.write(str(high_water))
+                file.flush()
+                os.fsync(file.fileno())
+        fsync_directory(self.filename)
+
+    def load(self) -> list[dict]:
+        return columns_to_rows(self.load_columns())
+
+    def load_columns(self) -> dict[str, list]:
+        values = {column: [] for column in self.columns}
+        for index, shard in enumerate(self.shards):
+            shard_values = shard.load_columns()
+            self._ids[index] = set(shard_values['id'])
+            for column, column_values in values.items():
+                column_values.extend(shard_values[column])
+        order = sorted(range(len(values['id'])), key=values['id'].__getitem__)  # merged in id order
+        return {column: [column_values[position] for position in order] for column, column_values in values.items()}
+
+    @contextmanager
+    def write_lock(self, task_ids: Optional[Collection[int]] = None) -> Iterator[None]:
+        if task_ids is None:
+            shards = range(self.shard_count)
+        else:
+            shards = sorted({self.shard_of(task_id) for task_id in task_ids})
+        with self._holding(shards, shared=False):
+            yield
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        with self._holding(range(self.shard_count), shared=True):
+            yield
+
+    @contextmanager
+    def _holding(self, shards: Iterable[int], shared: bool) -> Iterator[None]:
+        # Always in shard order, so two processes cannot wait on each other
+        try:
+            with ExitStack() as stack:
+                for index in shards:
+                    shard = self.shards[index]
+                    stack.enter_context(shard.read_lock() if shared else shard.write_lock())
+                    self._held.append(index)
+                yield
+        finally:
+            self._held = []
+
+    def committed(self) -> str:
+        # Shards are caught up one by one, so every shard's count goes in
+        return '-'.join(shard.committed() for shard in self.shards)
+
+    def changed_elsewhere(self) -> bool:
+        return any(shard.changed_elsewhere() for shard in self.shards)
+
+    def changes(self) -> Optional[list[dict]]:
+        '''Changes in the shards currently locked; the others cannot be read
+        safely now and are caught up when they are locked next'''
+        records = []
+        for index in self._held:
+            shard_records = self.shards[index].changes()
+            if shard_records is None:
+                shard_records = self._reload_shard(index)
+            else:
+                self._track_ids(index, shard_records)
+            records.extend(shard_records)
+        return records
+
+    def _reload_shard(self, index: int) -> list[dict]:
+        '''Another process compacted the shard past what we read: read it
+        again and describe the difference as ordinary records'''
+        rows = self.shards[index].load()
+        ids = {row['id'] for row in rows}
+        records = [{'op': 'delete', 'id': task_id} for task_id in sorted(self._ids[index] - ids)]
+        records.extend({'op': 'update', 'task': row} for row in rows)
+        self._ids[index] = ids
+        return records
+
+    def _track_ids(self, index: int, records: list[dict]) -> None:
+        ids = self._ids[index]
+        for record in records:
+            if record['op'] == 'delete':
+                ids.discard(record['id'])
+            else:
+                ids.add(record['task']['id'])
+
+    def append(self, records: list[dict]) -> None:
+        by_shard: dict[int, list[dict]] = {}
+        for record in records:
+            task_id = record['id'] if record['op'] == 'delete' else record['task']['id']
+            index = self.shard_of(task_id)
+            if index not in self._held:
+                raise RuntimeError(f"Task {task_id} is in shard {index}, which is not locked")
+            by_shard.setdefault(index, []).append(record)
+        if not hasattr(self._unsynced, 'shards'):
+            self._unsynced.shards = set()
+        for index in sorted(by_shard):
+            self.shards[index].append(by_shard[index])
+            self._track_ids(index, by_shard[index])
+            self._unsynced.shards.add(index)
+
+    def sync(self) -> None:
+        unsynced = getattr(self._unsynced, 'shards', ())
+        self._unsynced.shards = set()
+        for index in sorted(unsynced):
+            self.shards[index].sync()
+
+    def high_water_mark(self) -> int:
+        return max(shard.high_water_mark() for shard in self.shards)
+
+    def reserve_id(self, after: int) -> int:
+        '''The smallest id above after that one of the locked shards may hand out'''
+        candidates = []
+        for index in self._held:
+            base = max(after, self.shards[index].high_water_mark())
+            candidates.append(base + 1 + (index - base - 1) % self.shard_count)
+        return min(candidates)
+
+    def needs_compaction(self) -> bool:
+        return any(shard.needs_compaction() for shard in self.shards)
+
+    def position(self):
+        return tuple(shard.position() for shard in self.shards)
+
+    def write_snapshot(self, rows: list[dict]) -> dict:
+        '''Snapshots of just the shards that asked for compaction'''
+        due = [index for index, shard in enumerate(self.shards) if shard.needs_compaction()]
+        by_shard: dict[int, list[dict]] = {index: [] for index in due}
+        for row in rows:
+            shard_rows = by_shard.get(self.shard_of(row['id']))
+            if shard_rows is not None:
+                shard_rows.append(row)
+        return {index: self.shards[index].write_snapshot(shard_rows) for index, shard_rows in by_shard.items()}
+
+    def install_snapshot(self, snapshot: dict, position) -> None:
+        for index, shard_snapshot in snapshot.items():
+            self.shards[index].install_snapshot(shard_snapshot, position[index])
+
+    def discard_snapshot(self, snapshot: dict) -> None:
+        for index, shard_snapshot in snapshot.items():
+            self.shards[index].discard_snapshot(shard_snapshot)
+
+    def close(self) -> None:
+        for shard in self.shards:
+            shard.close()
@@ -0,0 +1,224 @@
+import csv
+import os
+import secrets
+import sqlite3
+from contextlib import contextmanager
+from typing import Collection, Iterator, Optional
+from locks import FileLock
+from shared_counter import SharedCounter
+from storage import TaskStorage
+
+# Prune the change feed used to keep other processes in sync past this many rows
+CHANGE_RETENTION_ROWS = 10_000
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    description TEXT,
+    status TEXT,
+    priority TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks(status);
+CREATE INDEX IF NOT EXISTS tasks_title ON tasks(title);
+CREATE TABLE IF NOT EXISTS task_changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS task_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+# Databases created before search moved to the in-memory index of every
+# backend carry a full-text table whose triggers cost every write
+LEGACY_FTS = '''
+DROP TRIGGER IF EXISTS tasks_fts_insert;
+DROP TRIGGER IF EXISTS tasks_fts_delete;
+DROP TRIGGER IF EXISTS tasks_fts_update;
+DROP TABLE IF EXISTS tasks_fts;
+'''
+
+
+class SqliteStorage(TaskStorage):
+    '''Tasks in a SQLite database in WAL mode.
+
+    Writes are indexed point updates inside a BEGIN IMMEDIATE transaction,
+    which also excludes writers in other processes. Every committed change
+    adds the task id to task_changes, so other processes catch up by
+    re-reading only the ids changed since the last sequence number they saw.
+    task_meta keeps the largest id ever created, so ids of deleted tasks
+    are not handed out again, and the epoch committed() names the data by.
+    A new database is seeded from the CSV file it replaces, if there is one.'''
+
+    def __init__(self, path: str, columns: list[str], import_csv: Optional[str] = None):
+        self.path = path
+        self.columns = columns
+        self._seq = 0
+        self._high_water = 0
+        self._pending_changes = 0
+        # Held around BEGIN IMMEDIATE ... COMMIT, so the commit counter is
+        # bumped by the same writer that committed, before the next one starts
+        self._file_lock = FileLock(path + '.lock')
+        self.commits = SharedCounter(path + '.commits')
+        created = not os.path.exists(path)
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+        self._conn.executescript(LEGACY_FTS)
+        # Random id of this database, the same for every process opening it
+        self._conn.execute("INSERT OR IGNORE INTO task_meta (key, value) VALUES ('epoch', ?)", (secrets.randbits(63),))
+        self._epoch = self._conn.execute("SELECT value FROM task_meta WHERE key = 'epoch'").fetchone()[0]
+        if created and import_csv is not None:
+            self._import_csv(import_csv)
+
+    def _import_csv(self, filename: str) -> None:
+        try:
+            with open(filename, mode='r', newline='') as file:
+                rows = [
+                    (int(row['id']), row['title'], row.get('description'), row.get('status'), row.get('priority') or None)
+                    for row in csv.DictReader(file)
+                ]
+        except FileNotFoundError:
+            return
+        with self._transaction():
+            self._conn.executemany('INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?)', rows)
+            self._raise_high_water(max((row[0] for row in rows), default=0))
+
+    def _raise_high_water(self, task_id: int) -> None:
+        self._conn.execute(
+            "INSERT INTO task_meta (key, value) VALUES ('id_high_water', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = max(value, excluded.value)", (task_id,))
+
+    def _read_high_water(self) -> None:
+        row = self._conn.execute("SELECT value FROM task_meta WHERE key = 'id_high_water'").fetchone()
+        self._high_water = row[0] if row else 0
+
+    @contextmanager
+    def _transaction(self, mode: str = 'IMMEDIATE') -> Iterator[None]:
+        self._conn.execute(f'BEGIN {mode}')
+        try:
+            yield
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+    def load(self) -> list[dict]:
+        if self._conn.in_transaction:
+            return self._read_all()  # reloading under write_lock()
+        with self._transaction('DEFERRED'):
+            return self._read_all()
+
+    def _read_all(self) -> list[dict]:
+        self._observe_commits()
+        cursor = self._conn.execute('SELECT id, title, description, status, priority FROM tasks ORDER BY id')
+        rows = [dict(zip(self.columns, row)) for row in cursor]
+        self._seq = self._last_seq()
+        self._read_high_water()
+        if rows:
+            self._high_water = max(self._high_water, rows[-1]['id'])
+        self._pending_changes = 0
+        return rows
+
+    def _last_seq(self) -> int:
+        row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'task_changes'").fetchone()
+        return row[0] if row else 0
+
+    @contextmanager
+    def write_lock(self, task_ids: Optional[Collection[int]] = None) -> Iterator[None]:
+        self._file_lock.acquire()
+        try:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            finally:
+                if self._conn.in_transaction:
+                    self._conn.commit()
+        finally:
+            self._file_lock.release()
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        # A read transaction sees one consistent snapshot of the database
+        with self._transaction('DEFERRED'):
+            yield
+
+    def committed(self) -> str:
+        # Readers do not exclude writers here, so the commit counter can be
+        # ahead of a read; the change sequence is read in the same transaction
+        return f'{self._epoch:x}.{self._seq}'
+
+    def changes(self) -> Optional[list[dict]]:
+        self._observe_commits()
+        changed = self._conn.execute('SELECT seq, id FROM task_changes WHERE seq > ? ORDER BY seq', (self._seq,)).fetchall()
+        last_seq = self._last_seq()
+        if last_seq == self._seq:
+            return []
+        self._read_high_water()
+        if not changed or changed[0][0] != self._seq + 1:
+            return None  # the changes we missed were pruned already
+        ids = sorted({task_id for _, task_id in changed})
+        placeholders = ','.join('?' * len(ids))
+        current = {
+            row[0]: dict(zip(self.columns, row))
+            for row in self._conn.execute(
+                f'SELECT id, title, description, status, priority FROM tasks WHERE id IN ({placeholders})', ids)
+        }
+        self._seq = last_seq
+        return [
+            {'op': 'update', 'task': current[task_id]} if task_id in current else {'op': 'delete', 'id': task_id}
+            for task_id in ids
+        ]
+
+    def append(self, records: list[dict]) -> None:
+        if not self._conn.in_transaction:
+            self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            for record in records:
+                if record['op'] == 'delete':
+                    task_id = record['id']
+                    self._conn.execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+                else:
+                    task = record['task']
+                    task_id = task['id']
+                    self._conn.execute(
+                        'INSERT INTO tasks (id, title, description, status, priority) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT(id) DO UPDATE SET title = excluded.title, description = excluded.description, '
+                        'status = excluded.status, priority = excluded.priority',
+                        (task_id, task['title'], task.get('description'), task.get('status'), task.get('priority')),
+                    )
+                cursor = self._conn.execute('INSERT INTO task_changes (id) VALUES (?)', (task_id,))
+                self._seq = cursor.lastrowid
+                if task_id > self._high_water:
+                    self._high_water = task_id
+                    self._raise_high_water(task_id)
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+        self._count_commit()
+        self._pending_changes += len(records)
+
+    def high_water_mark(self) -> int:
+        return self._high_water
+
+    def needs_compaction(self) -> bool:
+        return self._pending_changes >= CHANGE_RETENTION_ROWS
+
+    def position(self):
+        return self._seq
+
+    def install_snapshot(self, snapshot, position) -> None:
+        # The rows are already in place; only the change feed needs trimming
+        self._conn.execute('DELETE FROM task_changes WHERE seq <= ?', (position - CHANGE_RETENTION_ROWS,))
+        self._conn.commit()
+        self._pending_changes = 0
+        self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self) -> None:
+        self._conn.close()
+        self._file_lock.close()
+        self.commits.close()
@@ -0,0 +1,439 @@
+import csv
+import os
+from contextlib import contextmanager
+from typing import Collection, Iterator, Optional
+import binary_snapshot
+from locks import FileLock
+from shared_counter import SharedCounter
+from wal import GroupCommit, MutationLog, fsync_directory
+
+# Fold the mutation log back into the CSV once it grows past this size
+COMPACTION_THRESHOLD_BYTES = 1024 * 1024
+# How long a log flush waits for more writers to join it, and how many
+# pending appends make it start at once; 0 only groups writers that
+# arrive while a flush is already running
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('TASKS_GROUP_COMMIT_WINDOW_MS', '0'))
+GROUP_COMMIT_MAX_OPS = int(os.environ.get('TASKS_GROUP_COMMIT_MAX_OPS', '64'))
+# Columns a task may leave null. CSV has no null, so snapshots store one as
+# an empty field, and an empty field in these columns reads back as null
+NULLABLE_COLUMNS = ('description', 'status')
+
+
+def rows_to_columns(columns: list[str], rows: list[dict]) -> dict[str, list]:
+    return {column: [row.get(column) for row in rows] for column in columns}
+
+
+def columns_to_rows(values: dict[str, list]) -> list[dict]:
+    names = list(values)
+    return [dict(zip(names, row)) for row in zip(*values.values())]
+
+
+def nulls_from_csv(values: dict[str, list]) -> None:
+    '''Turn the empty fields of the nullable columns back into None, in place'''
+    for column in NULLABLE_COLUMNS:
+        if column in values:
+            values[column] = [value or None for value in values[column]]
+
+
+def apply_records(values: dict[str, list], records: list[dict]) -> None:
+    '''Replay log records onto column-wise rows in place. Updated tasks keep
+    their place and new ones go last, as replaying onto a dict keyed by id would.'''
+    if not records:
+        return
+    ids = values['id']
+    positions = dict(zip(ids, range(len(ids))))
+    deleted = set()
+    for record in records:
+        if record['op'] == 'delete':
+            position = positions.pop(record['id'], None)
+            if position is not None:
+                deleted.add(position)
+            continue
+        task = record['task']
+        position = positions.get(task['id'])
+        if position is None:
+            positions[task['id']] = len(ids)
+            for column, column_values in values.items():
+                column_values.append(task.get(column))
+        else:
+            for column, column_values in values.items():
+                column_values[position] = task.get(column)
+    if deleted:
+        for column, column_values in values.items():
+            values[column] = [value for position, value in enumerate(column_values) if position not in deleted]
+
+
+class TaskStorage:
+    '''Durable home of the task rows behind the in-memory TaskStore.
+
+    Rows are plain dicts with the CSV columns (id as an int); the store
+    loads them column-wise through load_columns(), which storages that can
+    read their data by column override. Mutations are
+    handed over as the same records the mutation log uses:
+    {"op": "create" | "update", "task": row} or {"op": "delete", "id": N}.
+    The store calls write_lock() around every read-modify-write, then
+    changes() to pick up what other processes wrote, then append(), and
+    once the lock is released, sync() before acknowledging the write.
+
+    Every append also bumps a SharedCounter all workers map, so readers can
+    tell from changed_elsewhere(), without touching the disk, that another
+    worker committed and a changes() under read_lock() is due.
+    committed() names the commit a process has read up to in a form every
+    worker shares, which is what the API's ETags are made of.'''
+
+    commits: Optional[SharedCounter] = None
+    _commits_seen = 0
+    # Whether compaction hands write_snapshot() every row, or just trims
+    writes_snapshots = False
+
+    def load(self) -> list[dict]:
+        '''Return every row and start tracking changes from this point'''
+        raise NotImplementedError
+
+    def load_columns(self) -> dict[str, list]:
+        '''What load() does, with the rows as one list of values per column'''
+        return rows_to_columns(self.columns, self.load())
+
+    def load_snapshot(self) -> Optional[tuple[binary_snapshot.Snapshot, list[dict]]]:
+        '''What load() does, for a storage whose data is an indexed binary
+        snapshot plus changes: the snapshot and the records to replay onto
+        it. None when there is no such snapshot, and load_columns() is due.'''
+        return None
+
+    @contextmanager
+    def write_lock(self, task_ids: Optional[Collection[int]] = None) -> Iterator[None]:
+        '''Exclude writers in other processes. A storage that locks parts of
+        the data separately only needs to cover task_ids; None means all of it.'''
+        raise NotImplementedError
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        '''Make changes() safe without excluding other readers'''
+        raise NotImplementedError
+
+    def committed(self) -> str:
+        '''Names the committed data as of the last load(), changes() or
+        append(): equal in any two processes that have read the same data'''
+        raise NotImplementedError
+
+    def changed_elsewhere(self) -> bool:
+        '''Whether another process committed since this one last caught up'''
+        return self.commits is not None and self.commits.value() != self._commits_seen
+
+    def _observe_commits(self) -> None:
+        '''Call before reading, so a commit racing the read is noticed next time'''
+        if self.commits is not None:
+            self._commits_seen = self.commits.value()
+
+    def _count_commit(self) -> None:
+        '''Call after appending, under write_lock()'''
+        if self.commits is not None:
+            self._commits_seen = self.commits.increment()
+
+    def changes(self) -> Optional[list[dict]]:
+        '''Records other processes wrote since we last looked, or None when
+        they can no longer be replayed and load() must be called again'''
+        raise NotImplementedError
+
+    def append(self, records: list[dict]) -> None:
+        raise NotImplementedError
+
+    def sync(self) -> None:
+        '''Return once everything this process appended is durable. Called
+        outside write_lock(), so writers that appended meanwhile can share
+        one flush; storages whose append() is durable already do nothing.'''
+
+    def high_water_mark(self) -> int:
+        '''Largest task id ever stored, deleted or not, as of the last
+        load(), changes() or append()'''
+        raise NotImplementedError
+
+    def reserve_id(self, after: int) -> int:
+        '''An id for a task created under the current write_lock(): above
+        after, the largest id the caller handed out, and above every id
+        stored. It must be appended before the lock is released.'''
+        return max(after, self.high_water_mark()) + 1
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def position(self):
+        '''Opaque marker of how much of the storage the caller has seen'''
+        return None
+
+    def write_snapshot(self, rows: list[dict]):
+        '''First half of a compaction, done without any lock held'''
+        return None
+
+    def install_snapshot(self, snapshot, position) -> None:
+        '''Second half of a compaction, called under write_lock()'''
+
+    def discard_snapshot(self, snapshot) -> None:
+        '''Throw away a snapshot that went stale before it was installed'''
+
+    def close(self) -> None:
+        pass
+
+
+class CsvStorage(TaskStorage):
+    '''tasks.csv as a snapshot plus an append-only mutation log next to it.
+
+    Every write appends one fsynced record to <filename>.log, so it costs
+    the same however many tasks exist; compaction folds the log back into
+    a fresh CSV. An fcntl lock on <filename>.lock serialises writers across
+    processes, and the log's inode and size tell what other processes
+    appended or whether one of them compacted.
+
+    Ids of deleted tasks are gone from the snapshot, so compaction first
+    saves the id high-water mark to <filename>.ids; between compactions the
+    create records in the log carry it.
+
+    With binary_snapshots, compaction also writes <filename>.bin, a
+    columnar copy of the new CSV that later loads read instead of parsing
+    it, as long as it still matches the CSV. With index_snapshots as well,
+    the file carries the store's indexes of the rows, which load_snapshot()
+    hands over so the store does not build them at startup.
+
+    Appends are written under the lock but fsynced by sync() after it, so
+    concurrent writers share one fsync (group commit). A write is
+    acknowledged only once its fsync is done, though readers may see it a
+    moment before.'''
+
+    writes_snapshots = True
+
+    def __init__(self, filename: str, columns: list[str], compact_threshold: int = COMPACTION_THRESHOLD_BYTES,
+                 binary_snapshots: bool = True, index_snapshots: bool = True,
+                 group_commit_window_ms: float = GROUP_COMMIT_WINDOW_MS,
+                 group_commit_max_ops: int = GROUP_COMMIT_MAX_OPS):
+        self.filename = filename
+        self.columns = columns
+        self.compact_threshold = compact_threshold
+        self.binary_snapshots = binary_snapshots
+        self.index_snapshots = binary_snapshots and index_snapshots
+        self.binary_path = filename + '.bin'
+        self.log = MutationLog(filename + '.log')
+        self.group_commit = GroupCommit(self.log.sync, group_commit_window_ms / 1000, group_commit_max_ops)
+        self.ids_path = filename + '.ids'
+        self._file_lock = FileLock(filename + '.lock')
+        self.commits = SharedCounter(filename + '.commits')
+        self._high_water = 0
+        # Inode and byte offset of the log as far as this process has applied it
+        self._log_ino: Optional[int] = None
+        self._log_offset = 0
+        # Inode of the CSV we loaded; compaction always replaces it
+        self._snapshot_ino: Optional[int] = None
+        self._locked = False
+
+    def load(self) -> list[dict]:
+        return columns_to_rows(self.load_columns())
+
+    def load_columns(self) -> dict[str, list]:
+        if self._locked:
+            return self._read_all()  # the file lock we hold already keeps compactions out
+        with self.read_lock():
+            return self._read_all()
+
+    def load_snapshot(self) -> Optional[tuple[binary_snapshot.Snapshot, list[dict]]]:
+        if not self.index_snapshots:
+            return None
+        if self._locked:
+            return self._read_indexed()
+        with self.read_lock():
+            return self._read_indexed()
+
+    def _read_all(self) -> dict[str, list]:
+        self._observe_commits()
+        self._snapshot_ino = self._csv_ino()
+        values = self._read_binary_snapshot()
+        if values is None:
+            values = self._read_csv()
+        nulls_from_csv(values)
+        apply_records(values, self._read_log(max(values['id'], default=0)))
+        return values
+
+    def _read_indexed(self) -> Optional[tuple[binary_snapshot.Snapshot, list[dict]]]:
+        self._observe_commits()
+        self._snapshot_ino = self._csv_ino()
+        try:
+            stamp = binary_snapshot.csv_stamp(self.filename)
+        except FileNotFoundError:
+            return None
+        snapshot = binary_snapshot.open_snapshot(self.binary_path, self.columns, stamp, NULLABLE_COLUMNS)
+        if snapshot is None or not snapshot.indexed:
+            return None
+        return snapshot, self._read_log(snapshot.max_id())
+
+    def _read_log(self, max_id: int) -> list[dict]:
+        '''The log records since the snapshot, whose largest id is max_id'''
+        self._high_water = max_id
+        try:
+            with open(self.ids_path) as file:
+                self._high_water = max(self._high_water, int(file.read()))
+        except (FileNotFoundError, ValueError):
+            pass
+        self.log.close()  # appends must go to the log we are about to read
+        self._log_ino, _ = self.log.identity()
+        records, self._log_offset = self.log.read_from(0)
+        self._track_ids(records)
+        return records
+
+    def _read_csv(self) -> dict[str, list]:
+        '''The CSV column by column, with the values csv.DictReader would give'''
+        header, rows = [], []
+        try:
+            with open(self.filename, mode='r', newline='') as file:
+                reader = csv.reader(file)
+                header = next(reader, [])
+                rows = [row for row in reader if row]  # DictReader skips blank lines too
+        except FileNotFoundError:
+            pass  # If the file does not exist, start with an empty store
+        width = len(header)
+        if any(len(row) != width for row in rows):
+            rows = [row[:width] + [None] * (width - len(row)) for row in rows]
+        read = dict(zip(header, map(list, zip(*rows))))
+        values = {column: read.get(column, [None] * len(rows)) for column in self.columns}
+        values['id'] = [int(task_id) for task_id in values['id']]  # Convert id to int
+        return values
+
+    def _csv_ino(self) -> Optional[int]:
+        try:
+            return os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _read_binary_snapshot(self) -> Optional[dict[str, list]]:
+        if not self.binary_snapshots:
+            return None
+        try:
+            stamp = binary_snapshot.csv_stamp(self.filename)
+        except FileNotFoundError:
+            return None
+        return binary_snapshot.read_snapshot(self.binary_path, self.columns, stamp)
+
+    def _track_ids(self, records: list[dict]) -> None:
+        for record in records:
+            task_id = record['id'] if record['op'] == 'delete' else record['task']['id']
+            if task_id > self._high_water:
+                self._high_water = task_id
+
+    @contextmanager
+    def write_lock(self, task_ids: Optional[Collection[int]] = None) -> Iterator[None]:
+        with self._holding(shared=False):
+            yield
+
+    @contextmanager
+    def read_lock(self) -> Iterator[None]:
+        # Shared lock: no other process may compact while we read snapshot + log
+        with self._holding(shared=True):
+            yield
+
+    @contextmanager
+    def _holding(self, shared: bool) -> Iterator[None]:
+        self._file_lock.acquire(shared=shared)
+        self._locked = True
+        try:
+            yield
+        finally:
+            self._locked = False
+            self._file_lock.release()
+
+    def committed(self) -> str:
+        # Commits are counted under the file lock that changes() and load()
+        # read under, so the count always matches what was read
+        return f'{self.commits.epoch:x}.{self._commits_seen}'
+
+    def changes(self) -> Optional[list[dict]]:
+        self._observe_commits()
+        log_ino, log_size = self.log.identity()
+        if self._log_ino is None and log_ino is not None and self._csv_ino() == self._snapshot_ino:
+            self._log_ino = log_ino  # the first log since we loaded; nothing was compacted
+        if log_ino != self._log_ino or log_size < self._log_offset:
+            self.log.close()  # the file we had open is no longer the log
+            return None  # another process compacted the log into a new snapshot
+        if log_size == self._log_offset:
+            return []
+        records, self._log_offset = self.log.read_from(self._log_offset)
+        self._track_ids(records)
+        return records
+
+    def append(self, records: list[dict]) -> None:
+        # Counted first: a crash after the append must not leave a commit
+        # that readers would take for the count before it
+        self._count_commit()
+        self.log.append(records, self._log_offset, sync=False)
+        self.group_commit.appended()
+        self._log_ino, self._log_offset = self.log.identity()
+        self._track_ids(records)
+
+    def sync(self) -> None:
+        self.group_commit.wait_durable()
+
+    def high_water_mark(self) -> int:
+        return self._high_water
+
+    def needs_compaction(self) -> bool:
+        return self._log_offset >= self.compact_threshold
+
+    def position(self):
+        return self._log_ino, self._log_offset
+
+    def write_snapshot(self, rows: list[dict]) -> tuple[str, Optional[str]]:
+        temp_path = f'{self.filename}.{os.getpid()}.tmp'
+        with open(temp_path, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=self.columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+            file.flush()
+            os.fsync(file.fileno())
+        if not self.binary_snapshots:
+            return temp_path, None
+        # os.replace keeps inode, size and mtime, so the stamp still holds once installed
+        binary_temp = f'{self.binary_path}.{os.getpid()}.tmp'
+        binary_snapshot.write_snapshot(binary_temp, self.columns, rows, binary_snapshot.csv_stamp(temp_path),
+                                       self.index_snapshots)
+        return temp_path, binary_temp
+
+    def install_snapshot(self, snapshot: tuple[str, Optional[str]], position) -> None:
+        log_ino, offset = position
+        if self._log_ino != log_ino:
+            # Another process compacted first; our snapshot is already stale
+            self.discard_snapshot(snapshot)
+            return
+        # Save the high-water mark before the log records carrying it go away
+        ids_temp = f'{self.ids_path}.{os.getpid()}.tmp'
+        with open(ids_temp, mode='w') as file:
+            file.write(str(self._high_water))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(ids_temp, self.ids_path)
+        csv_temp, binary_temp = snapshot
+        os.replace(csv_temp, self.filename)
+        self._snapshot_ino = self._csv_ino()
+        if binary_temp is not None:
+            os.replace(binary_temp, self.binary_path)
+        fsync_directory(self.filename)
+        self.log.truncate_before(offset)
+        self._log_ino, self._log_offset = self.log.identity()
+
+    def discard_snapshot(self, snapshot: tuple[str, Optional[str]]) -> None:
+        for path in snapshot:
+            if path is not None:
+                os.unlink(path)
+
+    def close(self) -> None:
+        self.log.close()
+        self._file_lock.close()
+        self.commits.close()
+
+
+def open_storage(backend: str, filename: str, columns: list[str]) -> TaskStorage:
+    '''Build the storage engine named by backend ("csv", "sqlite" or "sharded") for filename'''
+    if backend == 'csv':
+        return CsvStorage(filename, columns)
+    if backend == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(os.path.splitext(filename)[0] + '.db', columns, import_csv=filename)
+    if backend == 'sharded':
+        from sharded_storage import ShardedStorage
+        return ShardedStorage(filename, columns)
+    raise ValueError(f"Unknown storage backend: {backend}")
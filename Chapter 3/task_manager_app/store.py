@@ -0,0 +1,660 @@
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from array import array
+from itertools import islice, repeat
+from collections.abc import Mapping
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional
+from binary_snapshot import VERSION_COLUMN, Snapshot, TaskText
+from change_feed import ChangeFeed
+from locks import ReadWriteLock
+from models import TaskV2, TaskV2WithId, TaskWithId
+from search_index import LayeredPosting, LayeredPostings, SearchIndex, TitleIndex
+from storage import TaskStorage
+
+
+def intern_optional(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+# Changes applied to the in-memory state per hold of its write lock
+APPLY_CHUNK = 256
+
+# Priority of tasks stored before the field existed, as v2 has always shown them
+DEFAULT_PRIORITY = TaskV2.model_fields['priority'].default
+
+
+class TaskRecord(NamedTuple):
+    '''Resident form of a task.
+
+    A tuple of plain values has no per-instance __dict__ or fields-set
+    bookkeeping, so it takes a fraction of the memory of a Pydantic model
+    and gives the garbage collector one object to visit instead of several.
+    status and priority come from a handful of values and are interned, so
+    every record shares the same string objects. Models are built from
+    records only at the API boundary.
+
+    Records follow the v2 schema and serve both API versions: to_task()
+    projects the v1 fields and to_task_v2() the v2 ones, at the same cost.
+    Rows stored before priority existed are upgraded as they are read, to
+    the default priority, and reach storage in the new form the next time
+    the task is written or the storage is compacted, so no migration has
+    to rewrite the data up front.'''
+    id: int
+    title: str
+    description: Optional[str]
+    status: Optional[str]
+    # priority is a v2 field; v1 writes keep whatever the task already had
+    priority: str
+    # storage.committed() of the data in which this task last changed
+    version: str
+
+    @classmethod
+    def from_row(cls, row: dict, version: str) -> 'TaskRecord':
+        '''Build a record from a row the app wrote itself, skipping validation'''
+        return cls(row['id'], row['title'], row.get('description'),
+                   intern_optional(row.get('status')), sys.intern(row.get('priority') or DEFAULT_PRIORITY), version)
+
+    @classmethod
+    def from_columns(cls, values: dict[str, list], version: str) -> Iterator['TaskRecord']:
+        '''from_row() for every row of a storage's load_columns(), without a
+        dict per row; rows that come with a version of their own keep it'''
+        versions = repeat(version)
+        if VERSION_COLUMN in values:
+            versions = (row_version or version for row_version in values[VERSION_COLUMN])
+        return map(cls, values['id'], values['title'], values['description'], map(intern_optional, values['status']),
+                   (sys.intern(priority or DEFAULT_PRIORITY) for priority in values['priority']), versions)
+
+    @classmethod
+    def from_task(cls, task: TaskWithId, priority: str, version: str) -> 'TaskRecord':
+        return cls(task.id, task.title, task.description, intern_optional(task.status), sys.intern(priority), version)
+
+    def to_task(self) -> TaskWithId:
+        # Records only ever hold validated data, so there is nothing to check again
+        return TaskWithId.model_construct(id=self.id, title=self.title, description=self.description, status=self.status)
+
+    def to_task_v2(self) -> TaskV2WithId:
+        return TaskV2WithId.model_construct(id=self.id, title=self.title, description=self.description,
+                                            status=self.status, priority=self.priority)
+
+    def to_row(self) -> dict:
+        return {'id': self.id, 'title': self.title, 'description': self.description, 'status': self.status,
+                'priority': self.priority}
+
+    def to_snapshot_row(self) -> dict:
+        '''to_row() plus the version, which binary snapshots keep'''
+        row = self.to_row()
+        row[VERSION_COLUMN] = self.version
+        return row
+
+
+def planned_changes(records: list[dict], committed: str) -> list[tuple[str, int, Optional[TaskRecord]]]:
+    '''Log records as the (op, id, record) changes TaskStore._apply() takes'''
+    return [
+        ('delete', record['id'], None) if record['op'] == 'delete'
+        else (record['op'], record['task']['id'], TaskRecord.from_row(record['task'], committed))
+        for record in records
+    ]
+
+
+class TaskTable:
+    '''Task id -> TaskRecord, read through a binary snapshot when there is one.
+
+    The snapshot's tasks are not copied out: a record is built from the
+    mapped columns each time one is asked for, so every worker serving
+    the same snapshot shares its pages. Tasks written since are kept in an
+    overlay, and their snapshot rows join hidden, the set the store's
+    indexes over the snapshot share. Without a snapshot the overlay holds
+    every task.
+
+    get() and `in` may run without the store's lock: put() fills the
+    overlay before it hides a row, and get() looks again after finding a
+    row hidden.'''
+
+    def __init__(self, snapshot: Optional[Snapshot] = None, version: str = '', hidden: Optional[set[int]] = None):
+        self.snapshot = snapshot
+        # Version of the snapshot rows without one of their own
+        self.version = version
+        self.hidden: set[int] = set() if hidden is None else hidden
+        self._overlay: dict[int, TaskRecord] = {}
+        # Task ids in ascending order, for keyset pagination
+        self.ids = LayeredPosting(snapshot.ids if snapshot is not None else (), array('q'), self.hidden)
+        if snapshot is not None:
+            self._columns = [snapshot.texts(column) for column in ('title', 'description', 'status', 'priority',
+                                                                    VERSION_COLUMN)]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, task_id: int) -> bool:
+        return task_id in self._overlay or self._row_of(task_id) is not None
+
+    def __getitem__(self, task_id: int) -> TaskRecord:
+        record = self.get(task_id)
+        if record is None:
+            raise KeyError(task_id)
+        return record
+
+    def get(self, task_id: int) -> Optional[TaskRecord]:
+        record = self._overlay.get(task_id)
+        if record is not None:
+            return record
+        if task_id in self.hidden:
+            return self._overlay.get(task_id)  # put() in between
+        row = self._row_of(task_id)
+        return self._record(row) if row is not None else None
+
+    def _row_of(self, task_id: int) -> Optional[int]:
+        if self.snapshot is None or task_id in self.hidden:
+            return None
+        return self.snapshot.row_of(task_id)
+
+    def _record(self, row: int) -> TaskRecord:
+        titles, descriptions, statuses, priorities, versions = self._columns
+        return TaskRecord(self.snapshot.ids[row], titles.text(row), descriptions.text(row) or None,
+                          intern_optional(statuses.text(row) or None),
+                          sys.intern(priorities.text(row) or DEFAULT_PRIORITY), versions.text(row) or self.version)
+
+    def text(self, task_id: int) -> TaskText:
+        '''The title and description of a task, without building the whole
+        record of a snapshot row; call under the store's lock'''
+        record = self._overlay.get(task_id)
+        if record is not None:
+            return TaskText(task_id, record.title, record.description)
+        row = self._row_of(task_id)
+        if row is None:
+            raise KeyError(task_id)
+        titles, descriptions = self._columns[:2]
+        return TaskText(task_id, titles.text(row), descriptions.text(row) or None)
+
+    def put(self, record: TaskRecord) -> None:
+        task_id = record.id
+        if task_id in self._overlay:
+            self._overlay[task_id] = record
+            return
+        shown = self._row_of(task_id) is not None
+        if shown:
+            self.ids.remove(task_id)
+        self.ids.add(task_id)
+        self._overlay[task_id] = record
+        if shown:
+            self.hidden.add(task_id)
+
+    def delete(self, task_id: int) -> None:
+        if self._overlay.pop(task_id, None) is not None:
+            self.ids.remove(task_id)
+        elif self._row_of(task_id) is not None:
+            self.ids.remove(task_id)
+            self.hidden.add(task_id)
+
+    def copy(self) -> 'TaskTable':
+        '''A table of the same tasks, which later changes to this one leave alone'''
+        table = TaskTable(self.snapshot, self.version, set(self.hidden))
+        table._overlay = dict(self._overlay)
+        table.ids = LayeredPosting(self.ids.base, array('q', self.ids.overlay), table.hidden, self.ids.hidden_count)
+        return table
+
+
+class TaskTexts(Mapping):
+    '''Task id -> TaskText of the tasks in a TaskTable, all search() reads'''
+
+    def __init__(self, table: TaskTable):
+        self.table = table
+
+    def __getitem__(self, task_id: int) -> TaskText:
+        return self.table.text(task_id)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.table.ids)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+class TaskStore:
+    '''Process-resident copy of the task data, indexed by id.
+
+    Every row is read from the storage engine once by load(). Afterwards
+    reads are served from memory and each mutation is handed to the storage
+    as a small batch of records, so a write costs the same no matter how
+    many tasks exist. A background thread compacts the storage once it asks
+    for it.
+
+    A storage with an indexed binary snapshot hands it over mapped rather
+    than as rows. Tasks and indexes are then read from the mapping, which
+    all workers share through the page cache, and each worker only holds
+    what changed since the snapshot, until a compaction maps the next one.
+    Other storages are loaded into private copies in every worker.
+
+    Writers serialise on a commit lock plus the storage's write lock, so
+    workers in other processes are excluded too. Before writing, the store
+    applies any changes other processes committed since its last write, so
+    ids and updates are computed from the latest state. Storage I/O happens
+    under the commit lock only; the in-memory state is swapped under the
+    write side of a ReadWriteLock, so readers never wait for the disk.
+
+    Every change applied is also published to the store's ChangeFeed, in
+    the order it was applied.
+
+    The dataset and each task are versioned by the storage's committed(),
+    which every worker that has read the same commits agrees on, so a
+    validator one worker handed out is good at all of them.'''
+
+    def __init__(self, columns: list[str]):
+        self.columns = columns
+        self.storage: Optional[TaskStorage] = None
+        # Storage position covered by the in-memory state, for compaction
+        self._position = None
+        # Local versions only compare within one epoch; a new store starts a new one
+        self.epoch = secrets.token_hex(4)
+        # Bumped by every change the store applies, its own or another process's
+        self.version = 0
+        # storage.committed() of the state readers see; None while a batch
+        # is partly applied, which no other worker may ever see
+        self._committed: Optional[str] = None
+        self.last_modified = time.time()
+        self._tasks = TaskTable()
+        self._ids = self._tasks.ids
+        # Largest id ever handed out; ids of deleted tasks stay below it
+        self._high_water = 0
+        self.search_index = SearchIndex()
+        self.titles = TitleIndex()
+        # Field value -> sorted ids of the tasks with it
+        self._by_status = LayeredPostings()
+        self._by_priority = LayeredPostings()
+        self._rwlock = ReadWriteLock()
+        self._commit_lock = threading.RLock()
+        self._commit_depth = 0
+        self._compactor: Optional[threading.Thread] = None
+        self.feed = ChangeFeed()
+
+    def load(self, storage: TaskStorage) -> None:
+        with self._commit_lock:
+            self._close_storage()
+            self.storage = storage
+            self._load_rows()
+
+    def _load_rows(self) -> None:
+        loaded = self.storage.load_snapshot()
+        values = self.storage.load_columns() if loaded is None else None
+        committed = self.storage.committed()
+        version = self.version + 1
+        # Build the indexes aside and swap them in, so readers keep going meanwhile
+        fresh = TaskStore(self.columns)
+        if loaded is None:
+            for record in TaskRecord.from_columns(values, committed):
+                fresh._insert(record, loading=True)
+            fresh.titles.sort()
+        else:
+            snapshot, records = loaded
+            fresh._take_snapshot(snapshot, committed)
+            for _, task_id, record in planned_changes(records, committed):
+                if record is None:
+                    fresh._drop(task_id)
+                else:
+                    fresh._discard(task_id)
+                    fresh._insert(record)
+        self._rwlock.acquire_write()
+        try:
+            self._take(fresh)
+            self._position = self.storage.position()
+            self._high_water = max(self.storage.high_water_mark(), self.max_id())
+            self._committed = committed
+            self._bump(version)
+        finally:
+            self._rwlock.release_write()
+        self.feed.reset()
+
+    def _take_snapshot(self, snapshot: Snapshot, committed: str) -> None:
+        '''Serve the tasks of an indexed binary snapshot, and the indexes
+        stored with them, from the mapping'''
+        hidden: set[int] = set()
+        self._tasks = TaskTable(snapshot, committed, hidden)
+        self._ids = self._tasks.ids
+        self.search_index = SearchIndex.from_snapshot(snapshot, hidden)
+        self.titles = TitleIndex.from_snapshot(snapshot, hidden)
+        self._by_status = LayeredPostings(snapshot.postings['status'], hidden)
+        self._by_priority = LayeredPostings(snapshot.postings['priority'], hidden)
+
+    def _take(self, fresh: 'TaskStore') -> None:
+        '''Swap in the tasks and indexes of fresh; call under the write lock'''
+        self._tasks, self._ids = fresh._tasks, fresh._ids
+        self.search_index, self.titles = fresh.search_index, fresh.titles
+        self._by_status, self._by_priority = fresh._by_status, fresh._by_priority
+
+    def all(self) -> list[TaskWithId]:
+        with self._rwlock.read_locked():
+            records = [self._tasks[task_id] for task_id in self._ids]
+        return [record.to_task() for record in records]
+
+    def get(self, task_id: int) -> Optional[TaskWithId]:
+        record = self._tasks.get(task_id)
+        return record.to_task() if record is not None else None
+
+    def search(self, keyword: str, limit: Optional[int] = None) -> list[TaskWithId]:
+        with self._rwlock.read_locked():
+            task_ids = self.search_index.search(keyword, TaskTexts(self._tasks), limit)
+            records = [self._tasks[task_id] for task_id in task_ids]
+        return [record.to_task() for record in records]
+
+    def suggest(self, prefix: str, limit: int) -> list[TaskWithId]:
+        with self._rwlock.read_locked():
+            records = [self._tasks[task_id] for task_id in self.titles.suggest(prefix, limit)]
+        return [record.to_task() for record in records]
+
+    def filter(self, status: Optional[str] = None, title: Optional[str] = None,
+               priority: Optional[str] = None, project: Callable[[TaskRecord], object] = TaskRecord.to_task) -> list:
+        return self.page(status=status, title=title, priority=priority, project=project)[0]
+
+    def page(self, after: Optional[int] = None, limit: Optional[int] = None,
+             status: Optional[str] = None, title: Optional[str] = None,
+             priority: Optional[str] = None,
+             project: Callable[[TaskRecord], object] = TaskRecord.to_task) -> tuple[list, bool]:
+        '''Return up to limit tasks with an id above after, in id order, and
+        whether more tasks follow; project picks the model the records
+        become, TaskRecord.to_task_v2 for a v2 listing.
+
+        Status and priority have a hash index from value to the sorted ids
+        with it. Titles are nearly all distinct, so rather than keep a
+        posting per task, a title filter takes the run of the title index
+        that matches ignoring case and keeps the exact matches. The smallest
+        posting is walked from after on, and each id is looked up in the
+        others by bisection until the page is full, so a page costs about
+        limit lookups however deep the cursor is. Without filters the page
+        is read straight off the ordered id index.'''
+        with self._rwlock.read_locked():
+            records, has_more = self._page(after, limit, status, title, priority)
+        return [project(record) for record in records], has_more
+
+    def _page(self, after, limit, status, title, priority) -> tuple[list[TaskRecord], bool]:
+        postings = []
+        if status is not None:
+            postings.append(self._by_status.posting(status))
+        if title is not None:
+            postings.append(LayeredPosting(
+                [task_id for task_id in self.titles.matching(title) if self._tasks[task_id].title == title]))
+        if priority is not None:
+            postings.append(self._by_priority.posting(priority))
+        if len(postings) > 1:
+            postings.sort(key=len)
+            smallest, others = postings[0], postings[1:]
+            records = []
+            for task_id in smallest.after(after):
+                if all(task_id in posting for posting in others):
+                    if len(records) == limit:
+                        return records, True
+                    records.append(self._tasks[task_id])
+            return records, False
+        ids = postings[0] if postings else self._ids
+        task_ids = list(islice(ids.after(after), None if limit is None else limit + 1))
+        has_more = limit is not None and len(task_ids) > limit
+        return [self._tasks[task_id] for task_id in task_ids[:limit]], has_more
+
+    def counts(self) -> tuple[int, dict[Optional[str], int], dict[str, int]]:
+        '''Number of tasks, and per status and per priority, read off the
+        field indexes the write paths keep up to date'''
+        with self._rwlock.read_locked():
+            return (len(self._tasks), {status: len(ids) for status, ids in self._by_status.items()},
+                    {priority: len(ids) for priority, ids in self._by_priority.items()})
+
+    def current_version(self) -> tuple[str, float]:
+        '''Dataset version and the time it was reached, read together. A
+        partly applied batch gets a version of this store's own.'''
+        with self._rwlock.read_locked():
+            if self._committed is None:
+                return f'{self.epoch}.{self.version}', self.last_modified
+            return self._committed, self.last_modified
+
+    def task_version(self, task_id: int) -> Optional[str]:
+        record = self._tasks.get(task_id)
+        return record.version if record is not None else None
+
+    def max_id(self) -> int:
+        return self._ids.last() or 0
+
+    def next_id(self) -> int:
+        '''The id allocate_id() would hand out next'''
+        return self._high_water + 1
+
+    def allocate_id(self) -> int:
+        '''Reserve a new task id; call under locked() so the store is caught
+        up, and write the task before leaving it.
+
+        Ids only grow, so one taken by a task that was deleted later, or by a
+        write that failed, is never handed out again.'''
+        with self.locked([self.next_id()]):
+            self._high_water = max(self._high_water, self.storage.reserve_id(self._high_water))
+            return self._high_water
+
+    @contextmanager
+    def new_task_id(self) -> Iterator[int]:
+        '''Reserve an id for a task about to be created, holding only the
+        write lock that covers that id until the task is written'''
+        with self.locked([self.next_id()]):
+            yield self.allocate_id()
+
+    def put(self, task: TaskWithId) -> None:
+        self.write_batch([(task.id, task)])
+
+    def remove(self, task_id: int) -> bool:
+        with self.locked([task_id]):
+            if task_id not in self._tasks:
+                return False
+            self.write_batch([(task_id, None)])
+            return True
+
+    @contextmanager
+    def locked(self, task_ids: Optional[Iterable[int]] = None) -> Iterator[None]:
+        '''Hold the commit lock across a read-modify-write spanning several calls.
+
+        The outermost holder also takes the storage's inter-process write
+        lock and catches up with changes committed by other processes. A
+        storage split into shards locks only those of task_ids, when given;
+        nested calls must stay within them. On
+        the way out it waits for its writes to become durable, after
+        releasing both locks so the next writers can join the same flush.'''
+        with self._commit_lock:
+            self._commit_depth += 1
+            try:
+                if self._commit_depth > 1:
+                    yield
+                    return
+                storage = self.storage
+                with storage.write_lock(None if task_ids is None else list(task_ids)):
+                    self._catch_up()
+                    yield
+            finally:
+                self._commit_depth -= 1
+        storage.sync()
+
+    def is_stale(self) -> bool:
+        '''Whether another worker committed changes this store has not applied'''
+        storage = self.storage
+        return storage is not None and storage.changed_elsewhere()
+
+    def refresh(self) -> None:
+        '''Apply what other workers committed, replaying their changes rather
+        than reloading. Waits for a writer in this process to finish first:
+        it only caught up with what it locked, and other workers may commit
+        to the rest of a sharded storage meanwhile. Called from within
+        locked() on the same thread it does nothing, that caught up already.'''
+        with self._commit_lock:
+            if self._commit_depth or self.storage is None:
+                return
+            with self.storage.read_lock():
+                self._catch_up()
+
+    def _catch_up(self) -> None:
+        records = self.storage.changes()
+        if records is None:
+            # e.g. another process compacted the changes we missed away
+            self._load_rows()
+        elif records:
+            committed = self.storage.committed()
+            self._apply(planned_changes(records, committed), committed)
+
+    def write_batch(self, changes: list[tuple[int, Optional[TaskWithId]]]) -> None:
+        '''Apply (id, task) changes in order, where a task of None deletes the id.
+
+        All records are committed to storage in one append before any of
+        them becomes visible. Only commit-lock holders change the state, so
+        it can be read here without the ReadWriteLock; readers are held off
+        just while _apply() swaps the changes in.'''
+        if not changes:
+            return
+        with self.locked([task_id for task_id, _ in changes]):
+            records, planned = [], []
+            exists: dict[int, bool] = {}
+            for task_id, task in changes:
+                present = exists.get(task_id, task_id in self._tasks)
+                if task is None:
+                    records.append({'op': 'delete', 'id': task_id})
+                    planned.append(('delete', task_id, None))
+                    exists[task_id] = False
+                else:
+                    previous = self._tasks.get(task_id) if present else None
+                    # Stamped with the commit below once the append made it
+                    record = TaskRecord.from_task(task, previous.priority if previous is not None else DEFAULT_PRIORITY, '')
+                    op = 'update' if present else 'create'
+                    records.append({'op': op, 'task': record.to_row()})
+                    planned.append((op, task_id, record))
+                    exists[task_id] = True
+            self.storage.append(records)
+            committed = self.storage.committed()
+            planned = [(op, task_id, record._replace(version=committed) if record is not None else None)
+                       for op, task_id, record in planned]
+            self._apply(planned, committed)
+            self._maybe_compact()
+
+    def _apply(self, planned: list[tuple[str, int, Optional[TaskRecord]]], committed: str) -> None:
+        '''Make (op, id, record) changes already in storage visible, where a
+        record of None deletes the id; call under the commit lock, with the
+        storage.committed() the changes bring the store to.
+
+        Readers run on the event loop, so the changes are swapped in
+        APPLY_CHUNK at a time, each chunk under its own hold of the write
+        lock and with its own dataset version. Readers wait for one chunk at
+        most, and every state they can see has a version of its own, though
+        they may see a large batch partly applied; only the complete batch
+        takes the committed version. A task changed more than once in the
+        batch goes straight to its last state, the one its version names.
+        The storage position moves with the last chunk, so a compaction in
+        between never takes a partly applied batch for a complete one.'''
+        latest = {task_id: position for position, (_, task_id, _) in enumerate(planned)}
+        for start in range(0, len(planned), APPLY_CHUNK):
+            chunk = planned[start:start + APPLY_CHUNK]
+            last = start + APPLY_CHUNK >= len(planned)
+            self._rwlock.acquire_write()
+            try:
+                for position, (_, task_id, record) in enumerate(chunk, start):
+                    if latest[task_id] != position:
+                        continue
+                    if record is None:
+                        self._drop(task_id)
+                    else:
+                        self._discard(task_id)
+                        self._insert(record)
+                if last:
+                    self._position = self.storage.position()
+                    self._high_water = max(self._high_water, self.storage.high_water_mark())
+                self._committed = committed if last else None
+                self._bump(self.version + 1)
+            finally:
+                self._rwlock.release_write()
+            self.feed.publish(chunk)
+
+    def _bump(self, version: int) -> None:
+        self.version = version
+        self.last_modified = time.time()
+
+    def _insert(self, record: TaskRecord, loading: bool = False) -> None:
+        '''Index a record; while loading, titles are sorted once at the end'''
+        self._tasks.put(record)
+        self.search_index.add(record)
+        if loading:
+            self.titles.append(record.title, record.id)
+        else:
+            self.titles.add(record.title, record.id)
+        self._by_status.add(record.status, record.id)
+        self._by_priority.add(record.priority, record.id)
+
+    def _discard(self, task_id: int) -> None:
+        '''Drop a task from the indexes, but not from the id map'''
+        record = self._tasks.get(task_id)
+        if record is None:
+            return
+        self.search_index.remove(record)
+        self.titles.remove(record.title, task_id)
+        self._by_status.remove(record.status, task_id)
+        self._by_priority.remove(record.priority, task_id)
+
+    def _drop(self, task_id: int) -> None:
+        if task_id in self._tasks:
+            self._discard(task_id)
+            self._tasks.delete(task_id)
+
+    def _maybe_compact(self) -> None:
+        if not self.storage.needs_compaction():
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self.compact, name='task-compactor', daemon=True)
+        self._compactor.start()
+
+    def compact(self) -> None:
+        '''Hand the current tasks to the storage as a new snapshot, letting it
+        drop the changes the snapshot covers'''
+        # Only copies are taken under the lock, records are immutable, so
+        # building the rows and writing the snapshot keep requests flowing
+        with self._rwlock.read_locked():
+            storage, position = self.storage, self._position
+            tasks = self._tasks.copy()
+        rows = [tasks[task_id].to_snapshot_row() for task_id in tasks.ids] if storage.writes_snapshots else []
+        snapshot = storage.write_snapshot(rows)
+        with self.locked():
+            if self.storage is not storage:
+                storage.discard_snapshot(snapshot)  # the store was reloaded meanwhile
+                return
+            storage.install_snapshot(snapshot, position)
+            self._rebase()
+            self._position = storage.position()
+
+    def _rebase(self) -> None:
+        '''Read the tasks through the snapshot just installed, letting go of
+        the changes held since the previous one; call under the commit lock,
+        caught up. The tasks themselves stay as they are, so neither the
+        version nor the change feed moves.'''
+        loaded = self.storage.load_snapshot()
+        if loaded is None:
+            return
+        snapshot, records = loaded
+        fresh = TaskStore(self.columns)
+        fresh._take_snapshot(snapshot, self.storage.committed())
+        # The changes logged after the snapshot are in memory already
+        for task_id in {record['id'] if record['op'] == 'delete' else record['task']['id'] for record in records}:
+            record = self._tasks.get(task_id)
+            if record is None:
+                fresh._drop(task_id)
+            else:
+                fresh._discard(task_id)
+                fresh._insert(record)
+        self._rwlock.acquire_write()
+        try:
+            self._take(fresh)
+        finally:
+            self._rwlock.release_write()
+
+    def close(self) -> None:
+        '''Wait for a running compaction and release the storage'''
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._commit_lock:
+            self._close_storage()
+
+    def _close_storage(self) -> None:
+        if self.storage is not None:
+            self.storage.close()
+            self.storage = None
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the x-api-version check: a route dependency, as the
+task routes used to declare, against ApiVersionMiddleware.
+
+Requests are fed straight into the ASGI apps, so the numbers are the
+per-request cost of routing plus the version check, without a server
+or HTTP client in between.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Header, HTTPException, Depends, Request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from versioning import ApiVersionMiddleware
+
+REQUESTS = 20_000
+
+
+def print_section(title: str):
+    """Print a section header."""
+    print(f"\n{'='*60}")
+    print(f"{title}")
+    print(f"{'='*60}")
+
+
+async def enforce_version(x_api_version: str = Header(...)):
+    if x_api_version != "1":
+        raise HTTPException(status_code=426, detail="Please upgrade your client to use a supported API version.")
+
+
+def dependency_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/tasks/{task_id}")
+    async def get_task(task_id: int, request: Request, depends=Depends(enforce_version)):
+        return {"id": task_id}
+
+    return app
+
+
+def middleware_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/tasks/{task_id}")
+    async def get_task(task_id: int):
+        return {"id": task_id}
+
+    app.add_middleware(ApiVersionMiddleware, routes=app.routes)
+    return app
+
+
+async def call(app, version: bytes) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": "/tasks/1", "raw_path": b"/tasks/1",
+        "query_string": b"", "root_path": "", "server": ("test", 80), "client": ("test", 1),
+        "headers": [(b"host", b"test"), (b"x-api-version", version)],
+    }
+    status = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def measure(app, version: bytes) -> float:
+    """Microseconds per request"""
+    for _ in range(500):  # warm up, and let the middleware stack build
+        await call(app, version)
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await call(app, version)
+    return (time.perf_counter() - start) / REQUESTS * 1e6
+
+
+async def benchmark_versioning():
+    apps = [("Depends(enforce_version)", dependency_app()), ("ApiVersionMiddleware", middleware_app())]
+    for label, version in [("Supported version (x-api-version: 1)", b"1"), ("Unsupported version (x-api-version: 3)", b"3")]:
+        print_section(label)
+        timings = []
+        for name, app in apps:
+            timings.append(await measure(app, version))
+            print(f"{name:<28} {timings[-1]:8.1f} us/request  (status {await call(app, version)})")
+        print(f"{'Saved per request':<28} {timings[0] - timings[1]:8.1f} us")
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark_versioning())
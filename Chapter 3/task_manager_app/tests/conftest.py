@@ -9,6 +9,7 @@ This file provides fixtures that:
 
 import pytest
 import csv
+import glob
 import os
 import tempfile
 from fastapi.testclient import TestClient
@@ -37,14 +38,24 @@ def temp_csv_file():
     
     yield temp_path
     
-    # Cleanup: remove the temporary file after test completes
-    try:
-        os.unlink(temp_path)
-    except FileNotFoundError:
-        pass  # File already deleted
+    # Cleanup: remove the temporary file and whatever the storage engines wrote next to it
+    operations.close_tasks()
+    database_path = os.path.splitext(temp_path)[0] + '.db'
+    for path in (temp_path, temp_path + '.log', temp_path + '.lock', temp_path + '.ids', temp_path + '.bin',
+                 temp_path + '.commits', database_path + '.lock', database_path + '.commits',
+                 database_path, database_path + '-wal', database_path + '-shm', *glob.glob(temp_path + '.shard*')):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass  # File already deleted
 
 @pytest.fixture
-def mock_database_file(temp_csv_file, monkeypatch):
+def storage_backend():
+    """Storage engine the tests run against; override to parametrize a module."""
+    return 'csv'
+
+@pytest.fixture
+def mock_database_file(temp_csv_file, storage_backend, monkeypatch):
     """
     Override the database filename to use the temporary CSV file.
     
@@ -52,8 +63,9 @@ def mock_database_file(temp_csv_file, monkeypatch):
     1. The DATABASE_FILENAME constant in the operations module
     2. The open() function to redirect 'tasks.csv' to our temporary file
     """
-    # Patch the DATABASE_FILENAME in operations module
+    # Patch the DATABASE_FILENAME and storage engine in operations module
     monkeypatch.setattr(operations, 'DATABASE_FILENAME', temp_csv_file)
+    monkeypatch.setattr(operations, 'STORAGE_BACKEND', storage_backend)
     
     # For the hardcoded 'tasks.csv' in main.py's delete_task function,
     # we need to patch the open function
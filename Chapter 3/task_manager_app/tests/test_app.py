@@ -1,6 +1,11 @@
 import pytest
 # Fixtures are automatically available from conftest.py
 
+@pytest.fixture(params=['csv', 'sqlite', 'sharded'])
+def storage_backend(request):
+    """Run every test in this module against each storage engine."""
+    return request.param
+
 def test_get_all_tasks(client, expected_tasks):
     """Test getting all tasks from the temporary database."""
     response = client.get("/tasks")
@@ -0,0 +1,137 @@
+"""
+Tests for the async route handlers and the async storage layer.
+
+Reads must be answered from memory on the event loop, and writes must not
+stall it while they wait for the disk.
+"""
+
+import asyncio
+import gc
+import threading
+import time
+import httpx
+import async_operations
+import operations
+import wal
+from fastapi.testclient import TestClient
+from locks import ReadWriteLock
+from main import app
+from models import BulkCreate, Task
+
+HEADERS = {"x-api-version": "1"}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def async_client():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", headers=HEADERS)
+
+
+def test_reads_do_not_use_the_executor(mock_database_file, monkeypatch):
+    """Once loaded, reads never hop to a thread."""
+    async def scenario():
+        async with async_client() as client:
+            assert (await client.get("/tasks/1")).status_code == 200
+
+            def fail(*args):
+                raise AssertionError("read went through the storage executor")
+            monkeypatch.setattr(async_operations, "run_io", fail)
+
+            responses = await asyncio.gather(*(client.get(f"/tasks/{i % 3 + 1}") for i in range(300)))
+            assert all(response.status_code == 200 for response in responses)
+            assert (await client.get("/tasks", params={"status": "pending"})).json()[0]['id'] == 1
+            assert len((await client.get("/tasks/search/task")).json()) == 3
+
+    run(scenario())
+
+
+def test_slow_disk_does_not_block_reads(mock_database_file, monkeypatch):
+    """A write stuck in fsync leaves the event loop free to answer reads."""
+    real_fsync = wal.os.fsync
+
+    def slow_fsync(fd):
+        time.sleep(0.5)
+        real_fsync(fd)
+
+    async def scenario():
+        async with async_client() as client:
+            await client.get("/tasks")
+            monkeypatch.setattr(wal.os, "fsync", slow_fsync)
+            write = asyncio.create_task(client.post("/tasks", json={"title": "Slow write"}))
+            await asyncio.sleep(0.05)
+
+            started = time.monotonic()
+            response = await client.get("/tasks/2")
+            read_latency = time.monotonic() - started
+            assert response.status_code == 200
+            assert not write.done()
+            assert read_latency < 0.25
+
+            created = await write
+            assert created.json()['id'] == 4
+            assert (await client.get("/tasks/4")).json()['title'] == "Slow write"
+
+    run(scenario())
+
+
+def test_async_writes_round_trip(mock_database_file):
+    """Create, update, bulk and delete work through the async layer."""
+    async def scenario():
+        async with async_client() as client:
+            created = (await client.post("/tasks", json={"title": "Async"})).json()
+            updated = await client.put(f"/tasks/{created['id']}", json={"title": "Async 2", "status": "done"})
+            assert updated.json()['status'] == "done"
+            results = (await client.post("/tasks/bulk", json=[{"op": "delete", "id": created['id']}])).json()
+            assert results[0]['status_code'] == 200
+            assert (await client.delete(f"/tasks/{created['id']}")).status_code == 404
+
+    run(scenario())
+
+
+def test_large_batches_are_applied_in_chunks(mock_database_file, monkeypatch):
+    """Readers wait for one chunk of a big batch at most, and each chunk is a version of its own."""
+    monkeypatch.setattr("store.APPLY_CHUNK", 2)
+    store = operations.load_tasks()
+    holds = []
+    original = store._rwlock.acquire_write
+    monkeypatch.setattr(store._rwlock, "acquire_write", lambda: (holds.append(len(store.all())), original())[1])
+    version, seq = store.version, store.feed.seq
+
+    operations.apply_bulk([BulkCreate(op="create", task=Task(title=f"Bulk {i}")) for i in range(5)])
+    assert holds == [3, 5, 7]
+    assert store.version == version + 3
+    assert store.feed.seq == seq + 5
+    assert len(store.all()) == 8
+
+
+def test_waiting_readers_go_before_a_returning_writer():
+    """A writer that lets go and takes the lock again lets the waiting readers in first."""
+    lock = ReadWriteLock()
+    lock.acquire_write()
+    reader_in = threading.Event()
+
+    def read():
+        with lock.read_locked():
+            reader_in.set()
+            time.sleep(0.05)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    time.sleep(0.05)  # the reader is waiting now
+    lock.release_write()
+    lock.acquire_write()
+    try:
+        assert reader_in.is_set()
+    finally:
+        lock.release_write()
+    reader.join()
+
+
+def test_lifespan_unfreezes_the_heap_on_shutdown(mock_database_file):
+    """Each startup freezes what it loaded; shutdown hands it back, so repeated lifespans don't pile up."""
+    gc.unfreeze()
+    with TestClient(app):
+        assert gc.get_freeze_count() > 0
+    assert gc.get_freeze_count() == 0
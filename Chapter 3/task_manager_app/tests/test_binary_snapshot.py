@@ -0,0 +1,110 @@
+"""
+Tests for the binary snapshot written on compaction and read at startup.
+"""
+
+import os
+import binary_snapshot
+import operations
+from models import Task
+from search_index import SearchIndex
+from storage import CsvStorage
+
+
+def compact_with_changes():
+    operations.create_task(Task(title='Ünïcode', description='', status='pending'))
+    operations.delete_task(2)
+    operations.task_store.compact()
+    operations.close_tasks()
+
+
+def load_rows(path):
+    storage = CsvStorage(path, operations.columns)
+    rows = storage.load()
+    storage.close()
+    return rows
+
+
+def index_answers():
+    return [[task.id for task in tasks] for tasks in (
+        operations.search_tasks_by_keyword('task'), operations.search_tasks_by_keyword('nïc'),
+        operations.search_tasks_by_keyword('renamed'), operations.search_tasks_by_keyword('later'),
+        operations.suggest_tasks('re', 5), operations.suggest_tasks('test', 5),
+        operations.filter_tasks(status='completed'), operations.filter_tasks(status='pending'),
+        operations.filter_tasks(title='Test Task 3'),
+    )]
+
+
+def test_compaction_writes_a_matching_binary_snapshot(mock_database_file, monkeypatch):
+    """Startup reads the binary file and gets exactly what the CSV holds."""
+    compact_with_changes()
+    assert os.path.exists(mock_database_file + '.bin')
+
+    from_binary = load_rows(mock_database_file)
+    monkeypatch.setattr(binary_snapshot, 'read_snapshot', lambda *args: None)
+    from_csv = load_rows(mock_database_file)
+    assert from_binary == from_csv
+    assert [row['id'] for row in from_binary] == [1, 3, 4]
+    assert from_binary[2]['title'] == 'Ünïcode'
+
+
+def test_binary_snapshot_is_used_at_startup(mock_database_file, monkeypatch):
+    """No CSV parsing happens when the binary snapshot is current."""
+    compact_with_changes()
+    def fail(self):
+        raise AssertionError("CSV was parsed")
+    monkeypatch.setattr(CsvStorage, '_read_csv', fail)
+    assert [task.id for task in operations.read_all_tasks()] == [1, 3, 4]
+
+
+def test_stale_or_corrupt_binary_falls_back_to_csv(mock_database_file):
+    """A CSV changed behind its back, or a flipped byte, sends loads to the CSV."""
+    compact_with_changes()
+    with open(mock_database_file, 'a') as file:
+        file.write('9,Edited by hand,,pending\r\n')
+    assert [row['id'] for row in load_rows(mock_database_file)] == [1, 3, 4, 9]
+
+    stamp = binary_snapshot.csv_stamp(mock_database_file)
+    binary_snapshot.write_snapshot(mock_database_file + '.bin', operations.columns, [], stamp)
+    assert binary_snapshot.read_snapshot(mock_database_file + '.bin', operations.columns, stamp) == {column: [] for column in operations.columns}
+    with open(mock_database_file + '.bin', 'r+b') as file:
+        file.seek(binary_snapshot.HEADER.size - 1)
+        file.write(b'\xff')
+    assert binary_snapshot.read_snapshot(mock_database_file + '.bin', operations.columns, stamp) is None
+    assert len(load_rows(mock_database_file)) == 4
+
+
+def test_startup_takes_the_indexes_from_the_binary_snapshot(mock_database_file, monkeypatch):
+    """Only tasks logged since the snapshot get indexed at startup, and the
+    stored indexes answer like freshly built ones."""
+    compact_with_changes()
+    operations.create_task(Task(title='Logged later', description='after compaction', status='completed'))
+    operations.update_task(1, Task(title='Renamed task', description='', status='completed'))
+    operations.close_tasks()
+    added = []
+    original_add = SearchIndex.add
+    monkeypatch.setattr(SearchIndex, 'add', lambda index, task: added.append(task.id) or original_add(index, task))
+
+    assert [task.id for task in operations.read_all_tasks()] == [1, 3, 4, 5]
+    assert sorted(added) == [1, 5]
+    answers = index_answers()
+    assert answers[0] == [1, 3] and answers[3] == [5] and answers[-2] == [4]
+
+    operations.close_tasks()
+    monkeypatch.setattr(CsvStorage, 'load_snapshot', lambda self: None)
+    assert index_answers() == answers
+
+
+def test_workers_read_the_snapshot_in_place(mock_database_file):
+    """Nothing is copied out of the snapshot at startup; a worker keeps only
+    the tasks changed since, and lets them go once it compacts."""
+    compact_with_changes()
+    store = operations.load_tasks()
+    assert store._tasks._overlay == {} and store._by_status._changed == {}
+
+    operations.update_task(3, Task(title='Edited', description='', status='pending'))
+    assert list(store._tasks._overlay) == [3] and store._tasks.hidden == {3}
+    answers, version, seq = index_answers(), operations.read_dataset_version(), store.feed.seq
+    store.compact()
+    assert store._tasks._overlay == {} and store._tasks.hidden == set()
+    assert index_answers() == answers
+    assert operations.read_dataset_version() == version and store.feed.since(seq) == []
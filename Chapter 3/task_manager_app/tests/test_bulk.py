@@ -0,0 +1,84 @@
+"""
+Tests for the POST /tasks/bulk batch endpoint.
+"""
+
+import operations
+from storage import CsvStorage
+from store import TaskStore
+
+HEADERS = {"x-api-version": "1"}
+
+
+def bulk(client, ops):
+    response = client.post("/tasks/bulk", json=ops, headers=HEADERS)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_bulk_create_assigns_sequential_ids(client):
+    """Creates in one batch get consecutive ids after the current maximum."""
+    results = bulk(client, [
+        {"op": "create", "task": {"title": "A"}},
+        {"op": "create", "task": {"title": "B", "status": "pending"}},
+    ])
+    assert [(r['status_code'], r['id']) for r in results] == [(200, 4), (200, 5)]
+    assert results[1]['task'] == {"id": 5, "title": "B", "description": None, "status": "pending"}
+    assert client.get("/tasks/5", headers=HEADERS).json()['title'] == "B"
+
+
+def test_bulk_mixed_operations_with_per_item_results(client):
+    """Updates and deletes report their own outcome; a missing id fails only that item."""
+    results = bulk(client, [
+        {"op": "update", "id": 1, "task": {"title": "Renamed", "status": "completed"}},
+        {"op": "delete", "id": 2},
+        {"op": "delete", "id": 99},
+        {"op": "update", "id": 2, "task": {"title": "Gone"}},
+    ])
+    assert [r['status_code'] for r in results] == [200, 200, 404, 404]
+    assert results[2]['detail'] == "Task not found"
+    assert results[0]['task']['description'] == 'Description for task 1'
+
+    ids = [task['id'] for task in client.get("/tasks", headers=HEADERS).json()]
+    assert ids == [1, 3]
+
+
+def test_bulk_operations_see_earlier_items(client):
+    """A task created earlier in the batch can be updated and deleted later in it."""
+    results = bulk(client, [
+        {"op": "create", "task": {"title": "Draft"}},
+        {"op": "update", "id": 4, "task": {"title": "Final"}},
+        {"op": "create", "task": {"title": "Temp"}},
+        {"op": "delete", "id": 5},
+    ])
+    assert [r['status_code'] for r in results] == [200, 200, 200, 200]
+    assert results[1]['task']['title'] == "Final"
+    assert client.get("/tasks/4", headers=HEADERS).json()['title'] == "Final"
+    assert client.get("/tasks/5", headers=HEADERS).status_code == 404
+
+
+def test_bulk_persists_with_one_log_append(client, mock_database_file, monkeypatch):
+    """The whole batch reaches disk in one append and survives a reload."""
+    appends = []
+    store = operations.load_tasks()
+    original_append = store.storage.log.append
+    monkeypatch.setattr(store.storage.log, "append", lambda records, offset, **kwargs: (appends.append(len(records)), original_append(records, offset, **kwargs)))
+
+    bulk(client, [{"op": "create", "task": {"title": f"Task {i}"}} for i in range(50)] + [{"op": "delete", "id": 1}])
+    assert appends == [51]
+
+    fresh = TaskStore(operations.columns)
+    fresh.load(CsvStorage(mock_database_file, operations.columns))
+    assert len(fresh.all()) == 52
+    assert fresh.get(1) is None
+    fresh.close()
+
+
+def test_bulk_validates_every_item(client):
+    """One invalid item rejects the whole request before anything is written."""
+    response = client.post("/tasks/bulk", json=[
+        {"op": "create", "task": {"title": "Fine"}},
+        {"op": "create", "task": {"description": "no title"}},
+        {"op": "rename", "id": 1},
+    ], headers=HEADERS)
+    assert response.status_code == 422
+    assert len(client.get("/tasks", headers=HEADERS).json()) == 3
@@ -0,0 +1,114 @@
+"""
+Tests for the change feed: the ring buffer, the GET /tasks/changes long-poll
+and the Server-Sent Events stream.
+"""
+
+import asyncio
+import time
+import httpx
+import operations
+from change_feed import ChangeFeed
+from main import app, change_events
+from models import Task
+
+HEADERS = {"x-api-version": "1"}
+
+
+def test_feed_keeps_the_latest_events():
+    """Overflowing the ring buffer or resetting it makes older positions unusable."""
+    feed = ChangeFeed(size=3)
+    feed.publish([("create", n, None) for n in range(1, 6)])
+    assert [event.seq for event in feed.since(2)] == [3, 4, 5]
+    assert feed.since(5) == []
+    assert feed.since(1) is None
+    assert feed.since(6) is None
+    feed.reset()
+    assert feed.since(4) is None
+    assert feed.since(5) == []
+
+
+def test_changes_since_a_cursor(client):
+    """Each write shows up once, in order, with the task as it was written."""
+    start = client.get("/tasks/changes", headers=HEADERS).json()
+    assert start["changes"] == [] and not start["reset"]
+    client.post("/tasks", json={"title": "Watched"}, headers=HEADERS)
+    client.patch("/tasks/4", json={"status": "done"}, headers=HEADERS)
+    client.delete("/tasks/1", headers=HEADERS)
+
+    assert start["cursor"] == f'{start["epoch"]}:{start["seq"]}'
+    batch = client.get("/tasks/changes", params={"since": start["cursor"]}, headers=HEADERS).json()
+    assert [(change["op"], change["id"]) for change in batch["changes"]] == [
+        ("create", 4), ("update", 4), ("delete", 1),
+    ]
+    assert batch["changes"][1]["task"]["status"] == "done"
+    assert batch["changes"][2]["task"] is None
+    assert batch["seq"] == start["seq"] + 3
+    assert batch["cursor"] == f'{start["epoch"]}:{batch["seq"]}'
+
+    idle = client.get("/tasks/changes", params={"since": batch["cursor"], "timeout": 0}, headers=HEADERS).json()
+    assert idle["changes"] == [] and idle["cursor"] == batch["cursor"]
+
+
+def test_unknown_position_asks_for_a_resync(client):
+    start = client.get("/tasks/changes", headers=HEADERS).json()
+    ahead = f'{start["epoch"]}:{start["seq"] + 10}'
+    batch = client.get("/tasks/changes", params={"since": ahead}, headers=HEADERS).json()
+    assert batch["reset"] and batch["changes"] == [] and batch["cursor"] == start["cursor"]
+
+
+def test_cursor_from_another_worker_asks_for_a_resync(client):
+    """Sequence numbers are per worker, so one that came with another epoch, or with none, is never continued."""
+    start = client.get("/tasks/changes", headers=HEADERS).json()
+    client.post("/tasks", json={"title": "Missed"}, headers=HEADERS)
+    for since in (f'other:{start["seq"]}', str(start["seq"]), "garbage"):
+        batch = client.get("/tasks/changes", params={"since": since, "timeout": 0}, headers=HEADERS).json()
+        assert batch["reset"] and batch["changes"] == []
+        assert batch["cursor"] == f'{start["epoch"]}:{start["seq"] + 1}'
+
+
+def test_long_poll_returns_on_the_next_write(mock_database_file):
+    """A waiting request is answered as soon as a write lands, not at its timeout."""
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=HEADERS) as client:
+            cursor = (await client.get("/tasks/changes")).json()["cursor"]
+            started = time.monotonic()
+            poll = asyncio.create_task(client.get("/tasks/changes", params={"since": cursor, "timeout": 10}))
+            await asyncio.sleep(0.05)
+            assert not poll.done()
+            await client.post("/tasks", json={"title": "Pushed"})
+            batch = (await poll).json()
+            assert time.monotonic() - started < 5
+            assert batch["changes"][0]["task"]["title"] == "Pushed"
+
+    asyncio.run(scenario())
+
+
+def test_event_stream_sends_each_change(mock_database_file):
+    """The SSE stream names each event after its op and uses the seq as its id."""
+    async def scenario():
+        stream = change_events(None)
+        first = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.05)
+        await asyncio.get_running_loop().run_in_executor(None, operations.create_task, Task(title="Streamed"))
+        event = (await first).decode()
+        store = operations.task_store
+        assert event.startswith(f"id: {store.epoch}:{store.feed.seq}\nevent: create\ndata: ")
+        assert '"title":"Streamed"' in event
+        await stream.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_event_stream_resets_a_foreign_last_event_id(mock_database_file):
+    """Resuming from another worker's event id starts with a reset carrying this worker's cursor."""
+    async def scenario():
+        stream = change_events("other:1")
+        event = (await anext(stream)).decode()
+        store = operations.task_store
+        cursor = f"{store.epoch}:{store.feed.seq}"
+        assert event.startswith(f"id: {cursor}\nevent: reset\ndata: ")
+        assert f'"cursor":"{cursor}"' in event
+        await stream.aclose()
+
+    asyncio.run(scenario())
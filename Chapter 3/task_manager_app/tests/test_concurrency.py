@@ -0,0 +1,265 @@
+"""
+Stress tests for concurrent task writes.
+
+Writes run on the storage executor's threads and uvicorn may run several worker
+processes, so these tests hammer the operations layer from many threads
+and from several processes at once and check that no write is lost or
+duplicated.
+"""
+
+import multiprocessing
+import threading
+import time
+import pytest
+import operations
+import wal
+from fastapi.testclient import TestClient
+from main import app
+from models import Task, UpdateTask
+from storage import CsvStorage, open_storage
+from store import TaskStore
+
+THREADS = 16
+CREATES_PER_THREAD = 50
+
+
+def run_threads(target, count=THREADS):
+    errors = []
+
+    def wrapper(n):
+        try:
+            target(n)
+        except Exception as e:  # surface failures from worker threads
+            errors.append(e)
+
+    threads = [threading.Thread(target=wrapper, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def reload(path):
+    store = TaskStore(operations.columns)
+    store.load(CsvStorage(path, operations.columns))
+    tasks = store.all()
+    store.close()
+    return tasks
+
+
+def test_concurrent_creates_get_unique_ids(mock_database_file):
+    """Many threads creating at once never share an id or lose a task."""
+    created = []
+
+    def create(n):
+        for i in range(CREATES_PER_THREAD):
+            created.append(operations.create_task(Task(title=f"T{n}-{i}")).id)
+
+    run_threads(create)
+    total = THREADS * CREATES_PER_THREAD
+    assert len(set(created)) == total
+    assert sorted(created) == list(range(4, 4 + total))
+    assert len(reload(mock_database_file)) == 3 + total
+
+
+def test_concurrent_updates_and_deletes(mock_database_file):
+    """Interleaved updates and deletes leave memory and disk in agreement."""
+    ids = [operations.create_task(Task(title=f"Seed {i}")).id for i in range(THREADS)]
+
+    def churn(n):
+        for i in range(20):
+            operations.update_task(ids[n], UpdateTask(title=f"Seed {n} v{i}", status="in_progress"))
+            operations.update_task(1, UpdateTask(title=f"Shared by {n}"))
+        operations.delete_task(ids[n])
+
+    run_threads(churn)
+    in_memory = [task.model_dump() for task in operations.read_all_tasks()]
+    on_disk = [task.model_dump() for task in reload(mock_database_file)]
+    assert in_memory == on_disk
+    assert [task['id'] for task in on_disk] == [1, 2, 3]
+    assert on_disk[0]['title'].startswith("Shared by ")
+
+
+def test_reads_during_writes(mock_database_file):
+    """Readers see consistent snapshots while writers churn."""
+    stop = threading.Event()
+
+    def read(n):
+        while not stop.is_set():
+            tasks = operations.read_all_tasks()
+            assert [task.id for task in tasks] == sorted(task.id for task in tasks)
+            operations.search_tasks_by_keyword("task")
+            operations.read_tasks_page(limit=5, status="pending")
+            time.sleep(0.001)  # busy readers would mostly measure GIL contention
+
+    def write(n):
+        try:
+            for i in range(30):
+                task = operations.create_task(Task(title=f"Task {n}-{i}", status="pending"))
+                operations.delete_task(task.id)
+        finally:
+            stop.set()
+
+    readers = threading.Thread(target=run_threads, args=(read, 4))
+    readers.start()
+    run_threads(write, 4)
+    readers.join()
+    assert [task.id for task in operations.read_all_tasks()] == [1, 2, 3]
+
+
+def create_from_process(path, count):
+    operations.DATABASE_FILENAME = path
+    for i in range(count):
+        operations.create_task(Task(title=f"Process task {i}"))
+    operations.close_tasks()
+
+
+def test_concurrent_creates_from_several_processes(mock_database_file):
+    """Workers in separate processes serialise on the file lock and see each other's writes."""
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=create_from_process, args=(mock_database_file, 40)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    ids = [task.id for task in reload(mock_database_file)]
+    assert ids == list(range(1, 4 + 4 * 40))
+
+
+def test_reads_see_other_workers_writes(mock_database_file):
+    """A worker that only reads still sees what another worker committed."""
+    assert len(operations.read_all_tasks()) == 3
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(target=create_from_process, args=(mock_database_file, 5))
+    process.start()
+    process.join()
+    assert process.exitcode == 0
+
+    store = operations.task_store
+    assert store.is_stale()
+    # Plain reads never touch the disk; the async layer catches up first
+    assert len(operations.read_all_tasks()) == 3
+    reloads = []
+    original_load_rows = store._load_rows
+    store._load_rows = lambda: (reloads.append(1), original_load_rows())
+    try:
+        response = TestClient(app).get("/tasks", headers={"x-api-version": "1"})
+        assert [task['id'] for task in response.json()] == list(range(1, 9))
+    finally:
+        del store._load_rows
+    assert reloads == []  # caught up from the log, not by re-reading the CSV
+    assert not store.is_stale()
+
+
+def test_concurrent_writes_share_fsyncs(mock_database_file, monkeypatch):
+    """Writers that commit while a log flush is running share the next one,
+    and none returns before its write is on disk."""
+    operations.load_tasks()
+    storage = operations.task_store.storage
+    real_fsync = wal.os.fsync
+    synced = []
+
+    def slow_fsync(fd):
+        time.sleep(0.02)
+        real_fsync(fd)
+        synced.append(storage.group_commit._appended)
+
+    monkeypatch.setattr(wal.os, 'fsync', slow_fsync)
+    appended = threading.local()
+    real_append = storage.append
+
+    def append(records):
+        real_append(records)
+        appended.count = storage.group_commit._appended
+
+    monkeypatch.setattr(storage, 'append', append)
+    acknowledged = []
+
+    def create(n):
+        operations.create_task(Task(title=f"G{n}"))
+        acknowledged.append(storage.group_commit._durable >= appended.count)
+
+    run_threads(create)
+    assert all(acknowledged)
+    assert storage.group_commit._durable == THREADS
+    assert len(synced) < THREADS
+    assert len(reload(mock_database_file)) == 3 + THREADS
+
+
+@pytest.mark.parametrize("backend", ["csv", "sharded"])
+def test_writes_after_another_store_compacts_are_kept(mock_database_file, backend):
+    """A store whose log was compacted away by another one appends to the new log."""
+    first, second = TaskStore(operations.columns), TaskStore(operations.columns)
+    first.load(open_storage(backend, mock_database_file, operations.columns))
+    second.load(open_storage(backend, mock_database_file, operations.columns))
+    first.put(first.get(1).model_copy(update={'title': 'First'}))
+    with second.locked([1, 2]):  # catches up with the first write, so it can be compacted
+        second.put(second.get(2).model_copy(update={'title': 'Second'}))
+    for shard in getattr(second.storage, 'shards', ()):
+        shard.compact_threshold = 0  # every shard is due
+    second.compact()
+    # Same task, so the same log (or shard log) the first store had open
+    with first.locked([1]):
+        first.put(first.get(1).model_copy(update={'title': 'After compaction'}))
+    first.close()
+    second.close()
+
+    fresh = TaskStore(operations.columns)
+    fresh.load(open_storage(backend, mock_database_file, operations.columns))
+    assert [task.title for task in fresh.all()] == ['After compaction', 'Second', 'Test Task 3']
+    fresh.close()
+
+
+@pytest.mark.parametrize("backend", ["csv", "sqlite", "sharded"])
+def test_workers_hand_out_the_same_versions(mock_database_file, backend):
+    """Stores on the same data agree on versions, so an ETag from one worker is good at another."""
+    first, second = TaskStore(operations.columns), TaskStore(operations.columns)
+    first.load(open_storage(backend, mock_database_file, operations.columns))
+    for _ in range(2):  # a worker that reloaded has gone through more local versions
+        second.load(open_storage(backend, mock_database_file, operations.columns))
+    assert first.current_version()[0] == second.current_version()[0]
+
+    first.write_batch([(1, first.get(1).model_copy(update={'title': 'Once'})),
+                       (1, first.get(1).model_copy(update={'title': 'Twice'}))])
+    assert first.current_version()[0] != second.current_version()[0]
+    second.refresh()
+    assert second.get(1).title == 'Twice'
+    assert second.current_version()[0] == first.current_version()[0]
+    assert second.task_version(1) == first.task_version(1)
+    assert second.task_version(2) == first.task_version(2)
+    first.close()
+    second.close()
+
+
+def test_refresh_waits_for_a_writer_in_this_process(mock_database_file):
+    """A refresh while this worker writes to one shard still catches up with the others."""
+    first, second = TaskStore(operations.columns), TaskStore(operations.columns)
+    first.load(open_storage("sharded", mock_database_file, operations.columns))
+    second.load(open_storage("sharded", mock_database_file, operations.columns))
+    entered, release = threading.Event(), threading.Event()
+
+    def write_task_1():
+        with second.locked([1]):
+            entered.set()
+            release.wait()
+
+    writer = threading.Thread(target=write_task_1)
+    writer.start()
+    entered.wait()
+    # Task 2 lives in a shard the writer did not lock, so another worker can commit to it
+    with first.locked([2]):
+        first.put(first.get(2).model_copy(update={'title': 'Elsewhere'}))
+    refresher = threading.Thread(target=second.refresh)
+    refresher.start()
+    refresher.join(0.1)
+    waited = refresher.is_alive()
+    release.set()
+    writer.join()
+    refresher.join()
+    assert waited
+    assert second.get(2).title == 'Elsewhere'
+    first.close()
+    second.close()
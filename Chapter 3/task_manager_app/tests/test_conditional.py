@@ -0,0 +1,83 @@
+"""
+Tests for ETag / If-None-Match and Last-Modified on the task read endpoints.
+"""
+
+import operations
+
+HEADERS = {"x-api-version": "1"}
+
+
+def revalidate(client, path, response, **params):
+    headers = {**HEADERS, "If-None-Match": response.headers["ETag"]}
+    return client.get(path, params=params, headers=headers)
+
+
+def test_unchanged_listing_is_not_modified(client, monkeypatch):
+    """A poll with the current ETag gets a 304 and the body is never built."""
+    first = client.get("/tasks", headers=HEADERS)
+    assert first.headers["ETag"].startswith('"')
+    assert "Last-Modified" in first.headers
+
+    def fail():
+        raise AssertionError("body was built for a 304")
+    monkeypatch.setattr('main.read_all_tasks', fail)
+    second = revalidate(client, "/tasks", first)
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+
+def test_every_write_changes_the_dataset_etag(client):
+    """Create, update and delete each invalidate the listing ETag."""
+    etags = [client.get("/tasks", headers=HEADERS).headers["ETag"]]
+    task = client.post("/tasks", json={"title": "Polled"}, headers=HEADERS).json()
+    etags.append(client.get("/tasks", headers=HEADERS).headers["ETag"])
+    client.put(f"/tasks/{task['id']}", json={"title": "Polled again"}, headers=HEADERS)
+    etags.append(client.get("/tasks", headers=HEADERS).headers["ETag"])
+    client.delete(f"/tasks/{task['id']}", headers=HEADERS)
+    etags.append(client.get("/tasks", headers=HEADERS).headers["ETag"])
+    assert len(set(etags)) == 4
+
+    stale = client.get("/tasks", headers={**HEADERS, "If-None-Match": etags[0]})
+    assert stale.status_code == 200
+
+
+def test_task_etag_only_changes_with_that_task(client):
+    """Writes to other tasks leave a task's ETag alone."""
+    first = client.get("/tasks/1", headers=HEADERS)
+    client.put("/tasks/2", json={"title": "Someone else"}, headers=HEADERS)
+    assert revalidate(client, "/tasks/1", first).status_code == 304
+
+    client.put("/tasks/1", json={"title": "Changed"}, headers=HEADERS)
+    changed = revalidate(client, "/tasks/1", first)
+    assert changed.status_code == 200
+    assert changed.json()['title'] == "Changed"
+
+
+def test_if_modified_since(client):
+    """Without an ETag, Last-Modified is honoured at one-second resolution."""
+    client.get("/v2/tasks")
+    operations.task_store.last_modified -= 2  # the second of the load is over
+    last_modified = client.get("/v2/tasks").headers["Last-Modified"]
+    assert client.get("/v2/tasks", headers={"If-Modified-Since": last_modified}).status_code == 304
+    old = "Mon, 01 Jan 2001 00:00:00 GMT"
+    assert client.get("/v2/tasks", headers={"If-Modified-Since": old}).status_code == 200
+
+
+def test_if_modified_since_sees_a_write_in_the_same_second(client):
+    """A change right after a GET is never hidden behind the Last-Modified it sent."""
+    for path in ("/tasks", "/tasks/1"):
+        last_modified = client.get(path, headers=HEADERS).headers["Last-Modified"]
+        assert client.put("/tasks/1", json={"title": path}, headers=HEADERS).status_code == 200
+        headers = {**HEADERS, "If-Modified-Since": last_modified}
+        assert client.get(path, headers=headers).status_code == 200
+
+
+def test_missing_task_and_reload(client, mock_database_file):
+    """Unknown ids still 404, and the same data loaded again, as by another worker, keeps its ETag."""
+    assert client.get("/tasks/99", headers={**HEADERS, "If-None-Match": "*"}).status_code == 404
+    first = client.get("/tasks", headers=HEADERS)
+    task = client.get("/tasks/1", headers=HEADERS)
+    operations.close_tasks()
+    assert revalidate(client, "/tasks", first).status_code == 304
+    assert revalidate(client, "/tasks/1", task).status_code == 304
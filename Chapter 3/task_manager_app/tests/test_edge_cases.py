@@ -698,9 +698,11 @@ class TestAPISpecCompliance:
         response = client.request("HEAD", "/tasks")
         assert response.status_code == 405 or response.status_code == 200  # HEAD might be allowed
         
-        # Test unsupported methods on /tasks/{id}
+        # PATCH /tasks/{id} is supported, but needs a JSON body
         response = client.request("PATCH", "/tasks/1")
-        assert response.status_code == 405
+        assert response.status_code == 422
+        
+        # Test unsupported methods on /tasks/{id}
         
         response = client.request("POST", "/tasks/1")
         assert response.status_code == 405
@@ -0,0 +1,48 @@
+"""
+Tests for the streaming export endpoint GET /tasks/export.
+"""
+
+import json
+import operations
+
+HEADERS = {"x-api-version": "1"}
+
+
+def test_export_ndjson(client, expected_tasks):
+    """The default format is one JSON object per line."""
+    response = client.get("/tasks/export", headers=HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.text.splitlines()
+    assert [json.loads(line) for line in lines] == [task.model_dump() for task in expected_tasks]
+
+
+def test_export_json_array(client, expected_tasks):
+    """The json format streams a single valid array."""
+    response = client.get("/tasks/export", params={"format": "json"}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert response.json() == [task.model_dump() for task in expected_tasks]
+
+
+def test_export_empty(client, temp_csv_file):
+    """An empty dataset exports as no lines or an empty array."""
+    import os
+    os.unlink(temp_csv_file)
+    assert client.get("/tasks/export", headers=HEADERS).text == ""
+    assert client.get("/tasks/export", params={"format": "json"}, headers=HEADERS).json() == []
+
+
+def test_export_spans_several_batches(client, monkeypatch):
+    """Rows are pulled from the store page by page."""
+    monkeypatch.setattr(operations, "EXPORT_BATCH_SIZE", 2)
+    for i in range(3):
+        client.post("/tasks", json={"title": f"Extra {i}"}, headers=HEADERS)
+    response = client.get("/tasks/export", params={"format": "json"}, headers=HEADERS)
+    assert [task['id'] for task in response.json()] == [1, 2, 3, 4, 5, 6]
+
+
+def test_export_rejects_unknown_format(client):
+    """Only ndjson and json are supported."""
+    response = client.get("/tasks/export", params={"format": "xml"}, headers=HEADERS)
+    assert response.status_code == 422
@@ -0,0 +1,113 @@
+"""
+Tests for the status, title and priority filters on GET /tasks and GET /v2/tasks,
+which are served from hash indexes kept by the task store.
+"""
+
+import operations
+from models import Task, UpdateTask
+
+HEADERS = {"x-api-version": "1"}
+
+
+def list_ids(client, path="/tasks", **params):
+    response = client.get(path, params=params, headers=HEADERS)
+    assert response.status_code == 200
+    return [task['id'] for task in response.json()]
+
+
+def test_filter_by_status(client):
+    """Only tasks with the requested status are returned."""
+    assert list_ids(client, status="in_progress") == [2]
+    assert list_ids(client, status="unknown") == []
+
+
+def test_filter_by_title(client):
+    """Title filters match the exact title."""
+    assert list_ids(client, title="Test Task 3") == [3]
+    assert list_ids(client, title="Test Task") == []
+    client.post("/tasks", json={"title": "TEST TASK 3"}, headers=HEADERS)
+    assert list_ids(client, title="Test Task 3") == [3]
+    assert list_ids(client, title="TEST TASK 3") == [4]
+
+
+def test_combined_filters_intersect(client):
+    """Status and title filters must both match."""
+    client.post("/tasks", json={"title": "Test Task 3", "description": "again", "status": "pending"}, headers=HEADERS)
+    assert list_ids(client, title="Test Task 3") == [3, 4]
+    assert list_ids(client, title="Test Task 3", status="pending") == [4]
+    assert list_ids(client, title="Test Task 1", status="completed") == []
+
+
+def test_indexes_follow_writes(mock_database_file):
+    """Updates move tasks between index entries and deletes drop them."""
+    operations.update_task(1, UpdateTask(title="Test Task 1", status="completed"))
+    assert [t.id for t in operations.filter_tasks(status="completed")] == [1, 3]
+    assert operations.filter_tasks(status="pending") == []
+
+    operations.delete_task(3)
+    assert [t.id for t in operations.filter_tasks(status="completed")] == [1]
+
+    created = operations.create_task(Task(title="Later", status="completed"))
+    assert [t.id for t in operations.filter_tasks(status="completed")] == [1, created.id]
+
+
+def test_v2_priority_filter(mock_database_file, client):
+    """v2 listings expose and filter on priority, defaulting to 'lower'."""
+    with open(mock_database_file, 'w', newline='') as file:
+        file.write("id,title,description,status,priority\n"
+                   "1,Low,,pending,lower\n"
+                   "2,High,,pending,high\n"
+                   "3,Unset,,completed,\n")
+
+    response = client.get("/v2/tasks")
+    assert [(t['id'], t['priority']) for t in response.json()] == [(1, 'lower'), (2, 'high'), (3, 'lower')]
+    assert list_ids(client, "/v2/tasks", priority="high") == [2]
+    assert list_ids(client, "/v2/tasks", priority="lower") == [1, 3]
+    assert list_ids(client, "/v2/tasks", priority="high", status="completed") == []
+
+    # v1 updates keep the priority they cannot see
+    client.put("/tasks/2", json={"title": "Still high", "status": "completed"}, headers=HEADERS)
+    assert list_ids(client, "/v2/tasks", priority="high", status="completed") == [2]
+
+
+def test_legacy_rows_upgraded_lazily(mock_database_file, client):
+    """Rows without a priority column read as the default and gain it when next written, without a rewrite."""
+    with open(mock_database_file, 'w', newline='') as file:
+        file.write("id,title,description,status\n"
+                   "1,Old,,pending\n"
+                   "2,Untouched,,pending\n")
+
+    assert list_ids(client, "/v2/tasks", priority="lower") == [1, 2]
+    client.put("/tasks/1", json={"title": "Old", "status": "completed"}, headers=HEADERS)
+
+    with open(mock_database_file) as file:
+        assert file.readline() == "id,title,description,status\n"
+    records, _ = operations.task_store.storage.log.read_from()
+    assert records[-1]['task']['priority'] == 'lower'
+
+    operations.close_tasks()
+    assert [(t.id, t.priority) for t in operations.read_all_tasks_v2()] == [(1, 'lower'), (2, 'lower')]
+
+
+def test_stats_count_by_status_and_priority(mock_database_file, client):
+    """Counts come from the indexes, follow writes and group unset priorities under the default."""
+    with open(mock_database_file, 'w', newline='') as file:
+        file.write("id,title,description,status,priority\n"
+                   "1,Low,,pending,lower\n"
+                   "2,High,,pending,high\n"
+                   "3,Unset,,completed,\n")
+
+    stats = client.get("/tasks/stats", headers=HEADERS).json()
+    assert stats == {
+        "total": 3,
+        "by_status": [{"status": "pending", "count": 2}, {"status": "completed", "count": 1}],
+        "by_priority": [{"priority": "lower", "count": 2}, {"priority": "high", "count": 1}],
+    }
+
+    client.delete("/tasks/1", headers=HEADERS)
+    client.post("/tasks", json={"title": "No status"}, headers=HEADERS)
+    stats = client.get("/tasks/stats", headers=HEADERS).json()
+    assert stats["total"] == 3
+    assert stats["by_status"] == [
+        {"status": "completed", "count": 1}, {"status": "pending", "count": 1}, {"status": None, "count": 1},
+    ]
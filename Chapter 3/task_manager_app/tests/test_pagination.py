@@ -0,0 +1,93 @@
+"""
+Tests for limit/after keyset pagination on GET /tasks and GET /v2/tasks.
+"""
+
+from pagination import decode_cursor, encode_cursor
+
+HEADERS = {"x-api-version": "1"}
+
+
+def create_tasks(client, count):
+    for i in range(count):
+        response = client.post("/tasks", json={"title": f"Bulk {i}", "status": "pending"}, headers=HEADERS)
+        assert response.status_code == 200
+
+
+def walk(client, path, **params):
+    """Follow X-Next-Cursor until the listing is exhausted."""
+    pages = []
+    while True:
+        response = client.get(path, params=params, headers=HEADERS)
+        assert response.status_code == 200
+        pages.append([task['id'] for task in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+        params = {**params, "after": cursor}
+
+
+def test_limit_returns_first_page_with_cursor(client):
+    """A limited listing returns the first ids and a cursor for the rest."""
+    response = client.get("/tasks", params={"limit": 2}, headers=HEADERS)
+    assert response.status_code == 200
+    assert [task['id'] for task in response.json()] == [1, 2]
+    assert decode_cursor(response.headers["X-Next-Cursor"]) == 2
+    assert 'rel="next"' in response.headers["Link"]
+
+
+def test_walk_all_pages(client):
+    """Following cursors visits every task exactly once, in id order."""
+    create_tasks(client, 7)
+    assert walk(client, "/tasks", limit=3) == [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10]]
+
+
+def test_last_page_has_no_cursor(client):
+    """No cursor is sent when nothing follows the page."""
+    response = client.get("/tasks", params={"limit": 3}, headers=HEADERS)
+    assert [task['id'] for task in response.json()] == [1, 2, 3]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_cursor_survives_deleted_anchor(client):
+    """Deleting the task a cursor points at does not break the walk."""
+    first = client.get("/tasks", params={"limit": 1}, headers=HEADERS)
+    cursor = first.headers["X-Next-Cursor"]
+    client.delete("/tasks/1", headers=HEADERS)
+    response = client.get("/tasks", params={"limit": 1, "after": cursor}, headers=HEADERS)
+    assert [task['id'] for task in response.json()] == [2]
+
+
+def test_pagination_with_filters(client):
+    """Cursors work on filtered listings."""
+    create_tasks(client, 4)
+    assert walk(client, "/tasks", status="pending", limit=2) == [[1, 4], [5, 6], [7]]
+
+
+def test_pagination_with_several_filters(client):
+    """Cursors walk the ids matching every filter, and the last page has none."""
+    create_tasks(client, 4)
+    for _ in range(2):
+        client.post("/tasks", json={"title": "Bulk 1", "status": "pending"}, headers=HEADERS)
+    client.post("/tasks", json={"title": "Bulk 1", "status": "completed"}, headers=HEADERS)
+    assert walk(client, "/tasks", status="pending", title="Bulk 1", limit=1) == [[5], [8], [9]]
+    assert walk(client, "/tasks", status="pending", title="Bulk 1", limit=2) == [[5, 8], [9]]
+
+
+def test_invalid_cursor(client):
+    """Cursors that were not issued by the API are rejected."""
+    for cursor in ("not-a-cursor", encode_cursor(1).upper(), "!!!"):
+        response = client.get("/tasks", params={"after": cursor}, headers=HEADERS)
+        assert response.status_code == 400
+        assert response.json()['detail'] == 'Invalid cursor'
+
+
+def test_invalid_limit(client):
+    """Limits below one are validation errors."""
+    response = client.get("/tasks", params={"limit": 0}, headers=HEADERS)
+    assert response.status_code == 422
+
+
+def test_v2_pagination(client):
+    """GET /v2/tasks pages the same way."""
+    create_tasks(client, 2)
+    assert walk(client, "/v2/tasks", limit=2) == [[1, 2], [3, 4], [5]]
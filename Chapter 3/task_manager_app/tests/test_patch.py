@@ -0,0 +1,42 @@
+"""
+Tests for PATCH /tasks/{task_id}, the sparse partial update.
+"""
+
+import json
+import operations
+
+HEADERS = {"x-api-version": "1"}
+
+
+def test_patch_changes_only_sent_fields(client):
+    """A status flip leaves title and description alone."""
+    response = client.patch("/tasks/2", json={"status": "done"}, headers=HEADERS)
+    assert response.status_code == 200
+    assert response.json() == {
+        "id": 2, "title": "Test Task 2", "description": "Description for task 2", "status": "done",
+    }
+    assert client.get("/tasks/2", headers=HEADERS).json()['status'] == "done"
+
+
+def test_patch_null_clears_optional_fields(client):
+    """An explicit null clears description; a null title is rejected."""
+    response = client.patch("/tasks/1", json={"description": None}, headers=HEADERS)
+    assert response.json()['description'] is None
+    assert response.json()['title'] == "Test Task 1"
+    assert client.patch("/tasks/1", json={"title": None}, headers=HEADERS).status_code == 422
+
+
+def test_patch_missing_task(client):
+    assert client.patch("/tasks/99", json={"status": "done"}, headers=HEADERS).status_code == 404
+
+
+def test_patch_persists_one_record(client, mock_database_file):
+    """Only the patched task is written, and an empty diff writes nothing."""
+    client.patch("/tasks/3", json={"status": "archived"}, headers=HEADERS)
+    client.patch("/tasks/3", json={}, headers=HEADERS)
+    with open(mock_database_file + '.log') as file:
+        records = [json.loads(line) for line in file]
+    assert [(record['op'], record['task']['id']) for record in records] == [('update', 3)]
+
+    operations.close_tasks()
+    assert operations.read_task_by_id(3).status == "archived"
@@ -0,0 +1,79 @@
+"""
+Tests for the versioned LRU cache of encoded task listings.
+"""
+
+from main import response_cache
+from response_cache import ResponseCache
+
+HEADERS = {"x-api-version": "1"}
+
+
+def test_repeated_listing_is_served_from_cache(client, monkeypatch):
+    """The second identical query is a cache hit and skips the store."""
+    response_cache.clear()
+    first = client.get("/tasks", params={"status": "pending"}, headers=HEADERS)
+    hits = response_cache.hits
+
+    def fail(*args, **kwargs):
+        raise AssertionError("listing was rebuilt")
+    monkeypatch.setattr('main.read_tasks_page', fail)
+    second = client.get("/tasks", params={"status": "pending"}, headers=HEADERS)
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert response_cache.hits == hits + 1
+
+
+def test_cached_page_keeps_its_cursor(client):
+    """A cached page still links to the next one."""
+    first = client.get("/v2/tasks", params={"limit": 2})
+    second = client.get("/v2/tasks", params={"limit": 2})
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    assert 'rel="next"' in second.headers["Link"]
+
+
+def test_writes_invalidate_cached_listings(client):
+    """A mutation makes the next listing and search reflect it."""
+    assert len(client.get("/tasks/search/Fresh", headers=HEADERS).json()) == 0
+    client.post("/tasks", json={"title": "Fresh"}, headers=HEADERS)
+    assert len(client.get("/tasks/search/Fresh", headers=HEADERS).json()) == 1
+    assert client.get("/tasks", headers=HEADERS).json()[-1]['title'] == "Fresh"
+    assert client.get("/cache/stats").json()['invalidations'] >= 1
+
+
+def test_task_stats_bypass_the_cache(client):
+    """Stats are revalidated by ETag but never cached, so they count as no lookup at all."""
+    response_cache.clear()
+    before = response_cache.stats()
+    first = client.get("/tasks/stats", headers=HEADERS)
+    assert first.status_code == 200
+    revalidated = client.get("/tasks/stats", headers={**HEADERS, "If-None-Match": first.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert response_cache.stats() == before
+
+
+def test_lru_eviction_and_stats():
+    """The least recently used entries are evicted first, until the bytes fit the budget."""
+    cache = ResponseCache(maxbytes=100, max_entry_bytes=60)
+    cache.put("v1", "a", 1, 40)
+    cache.put("v1", "b", 2, 40)
+    assert cache.get("v1", "a") == 1
+    cache.put("v1", "c", 3, 30)
+    assert cache.get("v1", "b") is None
+    assert cache.get("v1", "a") == 1
+    assert cache.stats()["bytes"] == 70
+    assert cache.get("v2", "a") is None
+    assert cache.stats() == {
+        "size": 0, "bytes": 0, "maxbytes": 100, "max_entry_bytes": 60,
+        "hits": 2, "misses": 2, "evictions": 1, "invalidations": 1, "oversized": 0,
+    }
+
+
+def test_oversized_bodies_are_not_cached():
+    """A body over the per-entry cap is skipped instead of flushing the cache."""
+    cache = ResponseCache(maxbytes=100, max_entry_bytes=60)
+    cache.put("v1", "a", 1, 40)
+    cache.put("v1", "huge", 2, 61)
+    assert cache.get("v1", "huge") is None
+    assert cache.get("v1", "a") == 1
+    assert cache.stats()["oversized"] == 1
+    assert cache.stats()["bytes"] == 40
@@ -0,0 +1,109 @@
+"""
+Tests for GET /tasks/search/{keyword} and the inverted index behind it.
+"""
+
+from models import Task, TaskWithId, UpdateTask
+from search_index import SearchIndex
+import operations
+
+HEADERS = {"x-api-version": "1"}
+
+
+def search(client, keyword, **params):
+    response = client.get(f"/tasks/search/{keyword}", params=params, headers=HEADERS)
+    assert response.status_code == 200
+    return [task['id'] for task in response.json()]
+
+
+def test_search_matches_substrings_case_insensitively(client):
+    """Keywords match anywhere in the title or description."""
+    assert search(client, "TASK 2") == [2]
+    assert search(client, "descr") == [1, 2, 3]
+    assert search(client, "3") == [3]
+    assert search(client, "nothing here") == []
+
+
+def test_search_matches_across_title_and_description(client):
+    """The title and description are searched as one concatenated string."""
+    # "Test Task 1" + "Description for task 1" -> "test task 1description for task 1"
+    assert search(client, "1desc") == [1]
+
+
+def test_search_ranks_title_words_first(client):
+    """Whole-word title hits rank above description hits and plain substrings."""
+    client.post("/tasks", json={"title": "Write report", "description": "quarterly", "status": "pending"}, headers=HEADERS)
+    client.post("/tasks", json={"title": "Review", "description": "the report draft", "status": "pending"}, headers=HEADERS)
+    client.post("/tasks", json={"title": "Reports archive", "description": "old", "status": "pending"}, headers=HEADERS)
+
+    assert search(client, "report") == [4, 5, 6]
+
+
+def test_search_limit(client):
+    """The limit parameter caps the number of ranked results."""
+    assert search(client, "task", limit=2) == [1, 2]
+    response = client.get("/tasks/search/task", params={"limit": 0}, headers=HEADERS)
+    assert response.status_code == 422
+
+
+def test_search_index_follows_writes(mock_database_file):
+    """Creates, updates and deletes keep the index in sync."""
+    created = operations.create_task(Task(title="Buy milk", description="and bread"))
+    assert [t.id for t in operations.search_tasks_by_keyword("milk")] == [created.id]
+
+    operations.update_task(created.id, UpdateTask(title="Buy eggs"))
+    assert operations.search_tasks_by_keyword("milk") == []
+    assert [t.id for t in operations.search_tasks_by_keyword("eggs")] == [created.id]
+
+    operations.delete_task(created.id)
+    assert operations.search_tasks_by_keyword("eggs") == []
+
+
+def test_search_index_requires_ngrams_in_order():
+    """Candidates sharing every n-gram are still checked for the real substring."""
+    tasks = {1: TaskWithId(id=1, title="abcd bcde"), 2: TaskWithId(id=2, title="abcde")}
+    index = SearchIndex()
+    for task in tasks.values():
+        index.add(task)
+    assert index.search("abcde", tasks) == [2]
+    index.remove(tasks.pop(2))
+    assert index.search("abcde", tasks) == []
+    assert all(2 not in posting for posting in index._grams.values())
+
+
+def test_short_keywords_match_without_their_own_postings():
+    """One- and two-character keywords are found through the trigrams containing them."""
+    tasks = {1: TaskWithId(id=1, title="Xy"), 2: TaskWithId(id=2, title="box", description="y"), 3: TaskWithId(id=3, title="cat")}
+    index = SearchIndex()
+    for task in tasks.values():
+        index.add(task)
+    assert all(len(gram) == 3 for gram in index._grams)
+    assert index.search("x", tasks) == [1, 2]
+    assert index.search("xy", tasks) == [1, 2]
+    assert index.search("q", tasks) == []
+
+
+def suggest(client, prefix, **params):
+    response = client.get("/tasks/suggest", params={"prefix": prefix, **params}, headers=HEADERS)
+    assert response.status_code == 200
+    return [task['title'] for task in response.json()]
+
+
+def test_suggest_matches_title_prefixes(client):
+    """Prefixes match case-insensitively, in title order, up to limit."""
+    for title in ["beta", "Alpha two", "alpha one", "Alphabet"]:
+        client.post("/tasks", json={"title": title}, headers=HEADERS)
+    assert suggest(client, "ALPHA") == ["alpha one", "Alpha two", "Alphabet"]
+    assert suggest(client, "alpha", limit=2) == ["alpha one", "Alpha two"]
+    assert suggest(client, "test task") == ["Test Task 1", "Test Task 2", "Test Task 3"]
+    assert suggest(client, "gamma") == []
+    assert client.get("/tasks/suggest", params={"prefix": ""}, headers=HEADERS).status_code == 422
+
+
+def test_suggest_follows_writes(mock_database_file):
+    """Renames and deletes move tasks out of the title index."""
+    created = operations.create_task(Task(title="Plan trip"))
+    operations.update_task(created.id, UpdateTask(title="Book flights"))
+    assert operations.suggest_tasks("plan", 10) == []
+    assert [t.id for t in operations.suggest_tasks("book", 10)] == [created.id]
+    operations.delete_task(created.id)
+    assert operations.suggest_tasks("book", 10) == []
@@ -0,0 +1,281 @@
+"""
+Tests for the in-memory task store that backs operations.py.
+
+The store parses the CSV once and then serves reads from memory, so these
+tests check that lookups no longer depend on the file and that every
+mutation still reaches disk through the mutation log.
+"""
+
+import csv
+import json
+import os
+import threading
+import pytest
+import operations
+from fastapi.testclient import TestClient
+from main import app
+from models import Task, TaskWithId, TaskV2WithId, UpdateTask
+from storage import CsvStorage, open_storage
+from store import TaskRecord, TaskStore
+
+
+def read_csv_rows(path):
+    with open(path, newline='') as file:
+        return list(csv.DictReader(file))
+
+
+def test_store_loads_once_and_serves_from_memory(mock_database_file):
+    """After loading, point lookups must not touch the file."""
+    store = operations.load_tasks()
+    assert [task.id for task in store.all()] == [1, 2, 3]
+
+    # Corrupt the file on disk; reads keep coming from the store
+    with open(mock_database_file, 'w') as file:
+        file.write('garbage')
+
+    task = operations.read_task_by_id(2)
+    assert task is not None
+    assert task.title == 'Test Task 2'
+    assert len(operations.read_all_tasks()) == 3
+
+
+def test_store_reloads_when_database_filename_changes(mock_database_file, tmp_path, monkeypatch):
+    """Pointing DATABASE_FILENAME at another file loads that file instead."""
+    operations.load_tasks()
+    other = tmp_path / 'other.csv'
+    other.write_text('id,title,description,status\n7,Other,Elsewhere,pending\n')
+    monkeypatch.setattr(operations, 'DATABASE_FILENAME', str(other))
+
+    assert [task.id for task in operations.read_all_tasks()] == [7]
+
+
+def apply_sample_mutations():
+    created = operations.create_task(Task(title='Fresh', description='New', status='pending'))
+    assert created.id == 4
+    operations.update_task(1, UpdateTask(title='Renamed', status='completed'))
+    assert operations.delete_task(2) is True
+    assert operations.delete_task(2) is False
+
+
+def test_mutations_append_to_log_without_rewriting_csv(mock_database_file):
+    """Single-task writes append a log record and leave the snapshot alone."""
+    operations.load_tasks()
+    apply_sample_mutations()
+
+    assert [row['id'] for row in read_csv_rows(mock_database_file)] == ['1', '2', '3']
+    with open(mock_database_file + '.log') as file:
+        ops = [json.loads(line)['op'] for line in file]
+    assert ops == ['create', 'update', 'delete']
+
+
+def test_log_is_replayed_on_load(mock_database_file):
+    """A fresh store sees the snapshot plus every logged mutation."""
+    operations.load_tasks()
+    apply_sample_mutations()
+
+    store = TaskStore(operations.columns)
+    store.load(CsvStorage(mock_database_file, operations.columns))
+    assert [task.id for task in store.all()] == [1, 3, 4]
+    assert store.get(1).title == 'Renamed'
+    store.close()
+
+
+def test_torn_log_tail_is_ignored(mock_database_file):
+    """A half-written record from a crash is dropped on replay."""
+    operations.load_tasks()
+    apply_sample_mutations()
+    operations.close_tasks()
+    with open(mock_database_file + '.log', 'a') as file:
+        file.write('{"op":"delete","id":')
+
+    store = TaskStore(operations.columns)
+    store.load(CsvStorage(mock_database_file, operations.columns))
+    assert [task.id for task in store.all()] == [1, 3, 4]
+    store.close()
+
+
+def test_compaction_folds_log_into_snapshot(mock_database_file, monkeypatch):
+    """Passing the size threshold compacts the log in the background."""
+    store = operations.load_tasks()
+    monkeypatch.setattr(store.storage, 'compact_threshold', 1)
+    apply_sample_mutations()
+    operations.close_tasks()
+
+    # The first write triggered a compaction; whatever it did not cover is still in the log
+    assert [row['id'] for row in read_csv_rows(mock_database_file)] != ['1', '2', '3']
+    fresh = TaskStore(operations.columns)
+    fresh.load(CsvStorage(mock_database_file, operations.columns))
+    assert [task.id for task in fresh.all()] == [1, 3, 4]
+    fresh.compact()
+    fresh.close()
+
+    rows = read_csv_rows(mock_database_file)
+    assert [row['id'] for row in rows] == ['1', '3', '4']
+    assert rows[0]['title'] == 'Renamed'
+    assert rows[0]['status'] == 'completed'
+    assert os.path.getsize(mock_database_file + '.log') == 0
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_nulls_survive_compaction(mock_database_file, binary):
+    """A task without description or status still has nulls, not "", once compacted and loaded again."""
+    store = TaskStore(operations.columns)
+    store.load(CsvStorage(mock_database_file, operations.columns, binary_snapshots=binary))
+    store.put(TaskWithId(id=4, title='Bare'))
+    counts = store.counts()
+    store.compact()
+    store.close()
+
+    fresh = TaskStore(operations.columns)
+    fresh.load(CsvStorage(mock_database_file, operations.columns, binary_snapshots=binary))
+    task = fresh.get(4)
+    assert (task.description, task.status) == (None, None)
+    assert fresh.counts() == counts
+    fresh.close()
+
+
+def test_get_task_by_id_uses_store(client):
+    """The API reads single tasks through the store."""
+    response = client.get("/tasks/3", headers={"x-api-version": "1"})
+    assert response.status_code == 200
+    assert response.json()['title'] == 'Test Task 3'
+    assert operations.task_store.get(3) is not None
+
+
+def test_sqlite_backend_imports_csv_and_syncs_writers(mock_database_file, monkeypatch):
+    """The SQLite engine seeds itself from the CSV and sees other writers' changes."""
+    monkeypatch.setattr(operations, 'STORAGE_BACKEND', 'sqlite')
+    assert [task.id for task in operations.read_all_tasks()] == [1, 2, 3]
+
+    # A second store on the same database stands in for another worker process
+    other = TaskStore(operations.columns)
+    other.load(open_storage('sqlite', mock_database_file, operations.columns))
+    apply_sample_mutations()
+    with other.locked():
+        assert [task.id for task in other.all()] == [1, 3, 4]
+        assert other.get(1).title == 'Renamed'
+    other.close()
+
+    # Search is served from the store's index; the database keeps no full-text copy
+    assert [task.id for task in operations.search_tasks_by_keyword('enam')] == [1]
+    tables = operations.task_store.storage._conn.execute("SELECT name FROM sqlite_master WHERE name LIKE 'tasks_fts%'")
+    assert tables.fetchall() == []
+
+
+def test_trusted_rows_skip_validation(mock_database_file, monkeypatch):
+    """Rows from our own files become tasks, and are listed, without re-validation."""
+    def fail(self, **data):
+        raise AssertionError("task was validated again")
+    monkeypatch.setattr(TaskWithId, '__init__', fail)
+    monkeypatch.setattr(TaskV2WithId, '__init__', fail)
+
+    assert [task.title for task in operations.read_all_tasks()] == ['Test Task 1', 'Test Task 2', 'Test Task 3']
+    client = TestClient(app)
+    assert client.get("/tasks", headers={"x-api-version": "1"}).json()[0]['title'] == 'Test Task 1'
+    assert client.get("/v2/tasks").json()[0]['priority'] == 'lower'
+
+
+def test_compaction_builds_rows_outside_the_lock(mock_database_file, monkeypatch):
+    """Readers are never kept waiting while the snapshot rows are built."""
+    store = operations.load_tasks()
+    readers = []
+    to_row = TaskRecord.to_row
+    monkeypatch.setattr(TaskRecord, 'to_row', lambda record: readers.append(store._rwlock._readers) or to_row(record))
+    store.compact()
+    assert readers == [0, 0, 0]
+
+
+def test_tasks_are_held_as_compact_records(mock_database_file):
+    """The store keeps tuples with shared status strings, not Pydantic models."""
+    store = operations.load_tasks()
+    operations.create_task(Task(title='Another', status='pending'))
+    records = [store._tasks[task_id] for task_id in store._ids]
+    assert all(isinstance(record, TaskRecord) for record in records)
+    assert records[0].status is records[3].status
+    assert isinstance(store.get(1), TaskWithId)
+
+
+def test_deleted_ids_are_never_reused(mock_database_file, monkeypatch):
+    """The id high-water mark survives deletes, compaction and restarts."""
+    for backend in ('csv', 'sqlite'):
+        monkeypatch.setattr(operations, 'STORAGE_BACKEND', backend)
+        last = operations.create_task(Task(title='Last', id=2))
+        assert last.id > 3
+        assert operations.read_task_by_id(2).title == 'Test Task 2'
+        assert operations.delete_task(last.id)
+        if backend == 'csv':
+            operations.task_store.compact()
+        operations.close_tasks()
+
+        assert operations.get_next_id() == last.id + 1
+        assert operations.create_task(Task(title='After restart')).id == last.id + 1
+        operations.close_tasks()
+
+
+def test_sharded_storage_splits_tasks_by_id(mock_database_file, monkeypatch):
+    """The CSV is split into shards once; each write touches only its shard and reloads merge in id order."""
+    monkeypatch.setattr(operations, 'STORAGE_BACKEND', 'sharded')
+    monkeypatch.setattr('sharded_storage.SHARD_COUNT', 2)
+    assert [task.id for task in operations.read_all_tasks()] == [1, 2, 3]
+    storage = operations.task_store.storage
+    assert storage.shard_count == 2
+    assert [row['id'] for row in read_csv_rows(storage.shard_path(1))] == ['1', '3']
+
+    apply_sample_mutations()  # renames 1, deletes 2, creates 4
+    for index, ops in ((0, ['create', 'delete']), (1, ['update'])):
+        with open(storage.shard_path(index) + '.log') as file:
+            assert [json.loads(line)['op'] for line in file] == ops
+    operations.close_tasks()
+
+    fresh = TaskStore(operations.columns)
+    fresh.load(open_storage('sharded', mock_database_file, operations.columns))
+    assert [task.id for task in fresh.all()] == [1, 3, 4]
+    assert fresh.get(1).title == 'Renamed'
+    fresh.close()
+
+
+def test_sharded_writers_only_wait_for_their_shard(mock_database_file, monkeypatch):
+    """A writer in another process holding one shard does not hold up writes to the others."""
+    monkeypatch.setattr(operations, 'STORAGE_BACKEND', 'sharded')
+    monkeypatch.setattr('sharded_storage.SHARD_COUNT', 2)
+    operations.load_tasks()
+    other = open_storage('sharded', mock_database_file, operations.columns)
+    with other.write_lock([1]):
+        done = threading.Event()
+
+        def write():
+            operations.update_task(2, UpdateTask(title="Even"))
+            # A create only needs the shard of the id it gets
+            operations.create_task(Task(title='Created'))
+            done.set()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        assert done.wait(5)
+    writer.join()
+    other.close()
+    assert operations.read_task_by_id(2).title == "Even"
+    assert operations.read_task_by_id(4).title == "Created"
+
+
+def test_sharded_compaction_rewrites_one_shard(mock_database_file, monkeypatch):
+    """Only the shard past its threshold is compacted, and other stores catch up with it."""
+    monkeypatch.setattr(operations, 'STORAGE_BACKEND', 'sharded')
+    monkeypatch.setattr('sharded_storage.SHARD_COUNT', 2)
+    store = operations.load_tasks()
+    other = TaskStore(operations.columns)
+    other.load(open_storage('sharded', mock_database_file, operations.columns))
+    even = os.stat(store.storage.shard_path(0)).st_ino
+    odd = os.stat(store.storage.shard_path(1)).st_ino
+
+    storage = store.storage
+    monkeypatch.setattr(storage.shards[1], 'compact_threshold', 1)
+    operations.delete_task(3)
+    operations.close_tasks()
+    assert os.stat(storage.shard_path(0)).st_ino == even
+    assert os.stat(storage.shard_path(1)).st_ino != odd
+    assert [row['id'] for row in read_csv_rows(storage.shard_path(1))] == ['1']
+
+    with other.locked([3]):
+        assert other.get(3) is None
+    other.close()
@@ -0,0 +1,47 @@
+"""
+Tests for the x-api-version check done by ApiVersionMiddleware.
+"""
+
+
+def test_missing_version_header_is_a_validation_error(client):
+    """Without the header the request is refused with 422 naming it."""
+    response = client.get("/tasks")
+    assert response.status_code == 422
+    assert response.json()['detail'][0]['loc'] == ['header', 'x-api-version']
+
+
+def test_missing_header_reported_with_body_errors(client):
+    """A bad body is reported alongside the missing header, as before."""
+    response = client.post("/tasks", json={"description": "no title"})
+    assert response.status_code == 422
+    locations = [error['loc'] for error in response.json()['detail']]
+    assert ['header', 'x-api-version'] in locations
+    assert ['body', 'title'] in locations
+
+
+def test_unsupported_version_is_refused(client):
+    """Versions other than 1 and 2 get 426 and never reach the handler."""
+    response = client.delete("/tasks/1", headers={"x-api-version": "3"})
+    assert response.status_code == 426
+    assert client.get("/tasks/1", headers={"x-api-version": "1"}).status_code == 200
+
+
+def test_version_2_uses_the_v2_route(client):
+    """Version 2 on a path that has a /v2 handler is served by it."""
+    response = client.get("/tasks", headers={"x-api-version": "2"})
+    assert response.status_code == 200
+    assert all('priority' in task for task in response.json())
+    assert client.get("/tasks", headers={"x-api-version": "1"}).json()[0].keys() == {"id", "title", "description", "status"}
+
+
+def test_version_2_without_v2_route_is_refused(client):
+    """Version 2 on a route with no /v2 counterpart gets 426."""
+    response = client.post("/tasks", json={"title": "New"}, headers={"x-api-version": "2"})
+    assert response.status_code == 426
+
+
+def test_unknown_routes_are_not_found(client):
+    """Routing errors come first, whatever the version header says."""
+    assert client.get("/tasks/1/nothing", headers={"x-api-version": "3"}).status_code == 404
+    assert client.put("/tasks", headers={"x-api-version": "3"}).status_code == 405
+    assert client.get("/tasks/1/nothing", headers={"x-api-version": "1"}).status_code == 404
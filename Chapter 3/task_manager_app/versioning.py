@@ -0,0 +1,74 @@
+"""API versioning as a plain ASGI middleware.
+
+Every request under /tasks must say which API version it speaks in the
+x-api-version header. The middleware finds it with one scan of the raw
+header list, so the routes no longer carry a dependency that FastAPI
+would resolve and validate on every call.
+
+Version 1 goes to the routes as they are. Version 2 is routed to the
+/v2 handler for the same method and path when there is one. Everything
+else goes to a fallback app holding the same /tasks routes behind the
+old header dependency, which always refuses: it answers exactly as the
+routes did before, 404/405 for unknown routes, 422 listing a missing
+header together with any body errors, 426 for other versions, and never
+runs a handler."""
+
+from fastapi import FastAPI, Header, HTTPException, Depends
+from fastapi.routing import APIRoute
+
+VERSION_HEADER = b"x-api-version"
+VERSIONED_PREFIX = "/tasks"
+V2_PREFIX = "/v2"
+
+
+def is_versioned(path: str) -> bool:
+    return path == VERSIONED_PREFIX or path.startswith(VERSIONED_PREFIX + "/")
+
+
+async def reject_version(x_api_version: str = Header(...)):
+    # Only reached for requests the middleware did not let through
+    raise HTTPException(status_code=426, detail="Please upgrade your client to use a supported API version.")
+
+
+def unsupported_version_app(routes) -> FastAPI:
+    '''Copy of the versioned routes whose header dependency refuses every request'''
+    fallback = FastAPI(openapi_url=None, docs_url=None, redoc_url=None)
+    for route in routes:
+        if isinstance(route, APIRoute) and is_versioned(route.path):
+            fallback.router.add_api_route(route.path, route.endpoint, methods=route.methods,
+                                          dependencies=[Depends(reject_version)])
+    return fallback
+
+
+def v2_routes(routes) -> frozenset[tuple[str, str]]:
+    '''(method, path) of the /tasks routes a v2 route also serves'''
+    return frozenset(
+        (method, route.path[len(V2_PREFIX):])
+        for route in routes if isinstance(route, APIRoute) and route.path.startswith(V2_PREFIX + VERSIONED_PREFIX)
+        for method in route.methods
+    )
+
+
+class ApiVersionMiddleware:
+    def __init__(self, app, routes):
+        self.app = app
+        # (method, path) of the /tasks routes that also exist under /v2
+        self.v2_routes = v2_routes(routes)
+        self.fallback = unsupported_version_app(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_versioned(scope["path"]):
+            return await self.app(scope, receive, send)
+        version = None
+        for name, value in scope["headers"]:
+            if name == VERSION_HEADER:
+                version = value
+                break
+        if version == b"1":
+            return await self.app(scope, receive, send)
+        if version == b"2" and (scope["method"], scope["path"]) in self.v2_routes:
+            routed = dict(scope)
+            routed["path"] = V2_PREFIX + scope["path"]
+            routed["raw_path"] = routed["path"].encode()
+            return await self.app(routed, receive, send)
+        return await self.fallback(scope, receive, send)
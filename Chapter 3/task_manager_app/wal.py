@@ -0,0 +1,184 @@
+import json
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+
+def fsync_directory(path: str) -> None:
+    '''Make a rename or newly created file in the directory of path durable'''
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MutationLog:
+    '''Append-only log of task mutations kept next to the snapshot CSV.
+
+    Each record is one JSON line: {"op": "create" | "update", "task": {...}}
+    or {"op": "delete", "id": N}. Records carry the full task state, so
+    replaying a record that is already reflected in the snapshot is harmless.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def read_from(self, offset: int = 0) -> tuple[list[dict], int]:
+        '''Return the complete records after offset and the offset they end at.
+
+        A torn record left by a crash mid-append is not returned; the next
+        append cuts it off.'''
+        records = []
+        try:
+            with open(self.path, mode='rb') as file:
+                file.seek(offset)
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    offset += len(line)
+        except FileNotFoundError:
+            pass
+        return records, offset
+
+    def identity(self) -> tuple[Optional[int], int]:
+        '''(inode, size) of the log file; a new inode means it was compacted'''
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def append(self, records: list[dict], offset: int, sync: bool = True) -> None:
+        '''Append records at offset, dropping anything past it (a torn tail).
+
+        With sync=False the records are written but not fsynced; sync()
+        makes them durable later.'''
+        if self._file is not None and not self._is_current():
+            self.close()  # another process compacted; ours is the old, unlinked log
+        created = False
+        if self._file is None:
+            created = not os.path.exists(self.path)
+            self._file = open(self.path, mode='ab')
+        if os.fstat(self._file.fileno()).st_size != offset:
+            self._file.truncate(offset)
+        self._file.write(b''.join(
+            json.dumps(record, separators=(',', ':')).encode() + b'\n' for record in records
+        ))
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        if created:
+            fsync_directory(self.path)
+
+    def _is_current(self) -> bool:
+        '''Whether the open file is still the one at path'''
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def sync(self) -> None:
+        '''fsync what was appended so far.
+
+        Opens the log afresh, as a compaction may have closed or replaced
+        the file meanwhile; the records are then in the fsynced snapshot
+        already, and syncing the new log does no harm.'''
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def truncate_before(self, offset: int) -> None:
+        '''Drop the first offset bytes, keeping records appended after them.
+
+        The remainder is written to a temp file that atomically replaces
+        the log, so a crash leaves either the old or the new log.'''
+        self.close()
+        try:
+            with open(self.path, mode='rb') as file:
+                file.seek(offset)
+                tail = file.read()
+        except FileNotFoundError:
+            return
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, mode='wb') as file:
+            file.write(tail)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        fsync_directory(self.path)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class GroupCommit:
+    '''Shares one fsync among writers that appended close together.
+
+    A writer appends without syncing, releases its locks, then calls
+    wait_durable(). If no flush is running it leads one: it waits up to
+    window seconds, or until max_ops appends are pending, for more writers
+    to join, then fsyncs once for all of them. Writers arriving while that
+    fsync runs wait for it and form the next batch, so the number of
+    fsyncs grows with the number of batches, not of writes.'''
+
+    def __init__(self, sync: Callable[[], None], window: float = 0.0, max_ops: int = 64):
+        self._sync = sync
+        self.window = window
+        self.max_ops = max_ops
+        self._cond = threading.Condition()
+        self._appended = 0
+        self._durable = 0
+        self._flushing = False
+        self.flushes = 0
+
+    def appended(self) -> None:
+        '''Count an append that still needs a flush'''
+        with self._cond:
+            self._appended += 1
+            if self._appended - self._durable >= self.max_ops:
+                self._cond.notify_all()
+
+    def wait_durable(self) -> None:
+        '''Return once every append counted so far is on disk'''
+        with self._cond:
+            target = self._appended
+            while self._durable < target:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                try:
+                    self._lead_flush()
+                finally:
+                    self._flushing = False
+                    self._cond.notify_all()
+
+    def _lead_flush(self) -> None:
+        '''Called with the condition held; releases it while the disk works'''
+        deadline = time.monotonic() + self.window
+        while self._appended - self._durable < self.max_ops:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        covered = self._appended
+        self._cond.release()
+        try:
+            self._sync()
+        finally:
+            self._cond.acquire()
+        self._durable = max(self._durable, covered)
+        self.flushes += 1